@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# vim: ai ts=4 sts=4 et sw=4 nu
+"""
+(c) 2018 Ronan Delacroix
+Counts the database writes of a job lifecycle (Runnable.run), with and without delta persistence.
+Needs a local mongod :
+
+    python benchmarks/lifecycle_writes.py [mongodb://localhost/jobmanager_benchmark]
+"""
+import sys
+import mongoengine
+from jobmanager.common import timing
+from jobmanager.common.job import Job
+
+
+WRITE_COMMANDS = ('insert', 'update', 'delete', 'findAndModify')
+
+
+class NoopJob(Job):
+
+    def process(self):
+        return {'answer': 42}
+
+
+class FailingJob(Job):
+
+    def process(self):
+        raise Exception('Expected failure')
+
+
+def count_writes(job_class, delta_persistence, runs=20):
+    writes = []
+
+    def on_command(sender, command=None, **kwargs):
+        if command in WRITE_COMMANDS:
+            writes.append(command)
+
+    timing.db_command_timed.connect(on_command)
+    job_class.delta_persistence = delta_persistence
+    try:
+        for i in range(runs):
+            job = job_class()
+            job.status = 'pending'
+            job.save()
+            job = job_class.objects.get(pk=job.pk)
+            del writes[:]
+            job.safe_run()
+            yield len(writes)
+    finally:
+        timing.db_command_timed.disconnect(on_command)
+
+
+def main(uri='mongodb://localhost/jobmanager_benchmark'):
+    mongoengine.connect(host=uri)
+    Job.drop_collection()
+    print("%-12s %-10s %8s" % ('job', 'mode', 'writes'))
+    for job_class in (NoopJob, FailingJob):
+        for delta_persistence in (False, True):
+            counts = list(count_writes(job_class, delta_persistence))
+            print("%-12s %-10s %8.1f" % (job_class.__name__, 'delta' if delta_persistence else 'legacy', sum(counts) / float(len(counts))))
+    Job.drop_collection()
+
+
+if __name__ == '__main__':
+    main(*sys.argv[1:])
@@ -0,0 +1,248 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# vim: ai ts=4 sts=4 et sw=4 nu
+"""
+(c) 2018 Ronan Delacroix
+Job Manager benchmark suite : job lifecycle, progress updates, serialization, host telemetry and autodoc.
+
+Runs (package installed, or with PYTHONPATH=.) against a local mongod, or mongomock when given
+'mongomock://localhost' (needs mongomock installed, capped collections are then created uncapped) :
+
+    python benchmarks/run.py --db mongodb://localhost/jobmanager_benchmark --output results.json
+    python benchmarks/run.py --baseline results.json --tolerance 20
+
+Results are written as JSON. With --baseline, every benchmark slower than the baseline by more than tolerance
+percents is reported and the exit code is 1.
+"""
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import platform
+from datetime import datetime, timedelta
+import mongoengine
+import jobmanager.common as common
+from jobmanager.common.job import Job
+from jobmanager.common.host import Host, HostStatus
+from jobmanager.common.indexes import ensure_all_indexes
+
+
+BENCHMARKS = []
+
+
+def benchmark(name, operations):
+    """
+    Declares a benchmark : the decorated function runs 'operations' times the measured operation.
+    When it needs some setup, it returns the measured duration itself, excluding the setup.
+    """
+    def wraps(func):
+        func.benchmark_name = name
+        func.operations = operations
+        BENCHMARKS.append(func)
+        return func
+    return wraps
+
+
+class BenchmarkJob(Job):
+
+    def process(self):
+        return {'values': list(range(100))}
+
+
+class FakeClientService(object):
+    current_jobs = []
+
+
+def large_job():
+    job = BenchmarkJob()
+    job.result = {'rows': [{'index': i, 'label': 'row %d' % i, 'values': [i * 0.5] * 10, '_private': i} for i in range(500)]}
+    job.history = [{'t': datetime.utcnow(), 'm': 'Step %d' % i, 'c': i % 100, 's': 'running'} for i in range(1000)]
+    job.save()
+    return job
+
+
+def benchmark_host():
+    host = Host.objects(hostname='benchmark').first() or Host(hostname='benchmark', pid=os.getpid())
+    host.save()
+    host.host_status_index = 0
+    host.client_service = FakeClientService()
+    return host
+
+
+@benchmark('job_create', operations=200)
+def bench_job_create(operations):
+    for i in range(operations):
+        BenchmarkJob().save()
+
+
+@benchmark('job_run_lifecycle', operations=100)
+def bench_job_run(operations):
+    jobs = [BenchmarkJob(status='pending').save() for i in range(operations)]
+    start = time.perf_counter()
+    for job in jobs:
+        job.run()
+    return time.perf_counter() - start
+
+
+@benchmark('job_update_progress', operations=300)
+def bench_update_progress(operations):
+    job = BenchmarkJob(status='running').save()
+    for i in range(operations):
+        job.update_progress(i % 100, "Progress %d" % i)
+
+
+@benchmark('job_to_safe_dict', operations=50)
+def bench_to_safe_dict(operations):
+    job = large_job()
+    start = time.perf_counter()
+    for i in range(operations):
+        job.to_safe_dict()
+    return time.perf_counter() - start
+
+
+@benchmark('public_dict', operations=50)
+def bench_public_dict(operations):
+    son = large_job().to_mongo()
+    start = time.perf_counter()
+    for i in range(operations):
+        common.public_dict(son)
+    return time.perf_counter() - start
+
+
+@benchmark('job_to_json', operations=50)
+def bench_to_json(operations):
+    job = large_job()
+    start = time.perf_counter()
+    for i in range(operations):
+        job.to_json()
+    return time.perf_counter() - start
+
+
+@benchmark('host_update_status', operations=50)
+def bench_host_update_status(operations):
+    host = benchmark_host()
+    start = time.perf_counter()
+    for i in range(operations):
+        host.update_status()
+    return time.perf_counter() - start
+
+
+@benchmark('host_history_page', operations=50)
+def bench_host_history(operations):
+    host = benchmark_host()
+    now = datetime.utcnow()
+    HostStatus._get_collection().insert_many([
+        {'_cls': 'HostStatus', 'host': {'_id': host.pk, 'hostname': host.hostname}, 'index': i,
+         'created': now - timedelta(seconds=i), 'system_status': {}, 'current_jobs': []}
+        for i in range(2000)
+    ])
+    start = time.perf_counter()
+    token = None
+    for i in range(operations):
+        page, token = host.history_page(limit=30, token=token)
+    return time.perf_counter() - start
+
+
+@benchmark('job_get_doc', operations=200)
+def bench_get_doc(operations):
+    for i in range(operations):
+        Job.clear_doc_cache()
+        Job.get_all_docs()
+
+
+@benchmark('job_get_doc_cached', operations=2000)
+def bench_get_doc_cached(operations):
+    Job.get_all_docs()
+    start = time.perf_counter()
+    for i in range(operations):
+        Job.get_all_docs()
+    return time.perf_counter() - start
+
+
+def connect(db):
+    """
+    Connects to a mongodb:// URI, or to mongomock given a mongomock:// one.
+    """
+    if not db.startswith('mongomock://'):
+        return mongoengine.connect(host=db)
+    import mongomock
+    for document in (Job, Host, HostStatus):
+        document._meta['max_documents'] = document._meta['max_size'] = None
+    return mongoengine.connect(host='mongodb://' + db[len('mongomock://'):], mongo_client_class=mongomock.MongoClient)
+
+
+def clean_database():
+    for document in (Job, Host, HostStatus):
+        document.drop_collection()  # HostStatus is capped, documents can't be deleted from it
+    ensure_all_indexes()
+
+
+def run(names=None, repeat=3):
+    results = {}
+    for func in BENCHMARKS:
+        if names and func.benchmark_name not in names:
+            continue
+        durations = []
+        for i in range(repeat):
+            clean_database()
+            start = time.perf_counter()
+            measured = func(func.operations)
+            durations.append(measured if measured is not None else time.perf_counter() - start)
+        best = min(durations)
+        results[func.benchmark_name] = {
+            'operations': func.operations,
+            'best': round(best, 6),
+            'per_operation': best / func.operations,
+            'operations_per_second': round(func.operations / best, 1) if best else None,
+        }
+        print("%-22s %10.1f ops/s %12.3f ms/op" % (func.benchmark_name, results[func.benchmark_name]['operations_per_second'] or 0, best / func.operations * 1000.0))
+    clean_database()
+    return results
+
+
+def compare(results, baseline, tolerance):
+    regressions = []
+    for name, result in results.items():
+        reference = baseline.get('results', {}).get(name)
+        if not reference:
+            continue
+        change = (result['per_operation'] / reference['per_operation'] - 1.0) * 100.0
+        if change > tolerance:
+            regressions.append((name, change))
+            print("REGRESSION %-22s +%.1f%%" % (name, change))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Job Manager benchmarks')
+    parser.add_argument('--db', default='mongodb://localhost/jobmanager_benchmark', help='mongodb:// or mongomock:// URI')
+    parser.add_argument('--output', help='JSON results file')
+    parser.add_argument('--baseline', help='JSON results file to compare with')
+    parser.add_argument('--tolerance', type=float, default=20.0, help='Allowed slowdown in percents (default 20)')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('benchmarks', nargs='*', help='Benchmark names (default all)')
+    args = parser.parse_args()
+
+    connect(args.db)
+    results = run(args.benchmarks, repeat=args.repeat)
+    output = {
+        'date': datetime.utcnow().isoformat(),
+        'host': socket.gethostname(),
+        'python': platform.python_version(),
+        'db': args.db.split('://')[0],
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(output, f, indent=2, sort_keys=True)
+    if args.baseline:
+        with open(args.baseline) as f:
+            if compare(results, json.load(f), args.tolerance):
+                return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -11,3 +11,11 @@ def clean():
     print(cyan('Cleaning .pyc files...'))
     local('find . -name "*.pyc" -exec rm -rf {} \\;')
 
+
+
+@task
+def ensure_indexes(db='mongodb://localhost/jobmanager', imports=''):
+    """Build database indexes (run at each deploy). Usage : fab app.ensure_indexes:db=<uri>,imports=<mod1;mod2>"""
+    print(cyan('Building database indexes...'))
+    import_args = ' '.join('--import %s' % i for i in imports.split(';') if i)
+    local('python -m jobmanager.common.indexes --db %s %s' % (db, import_args))
@@ -10,6 +10,7 @@ import pkgutil
 __path__ = pkgutil.extend_path(__path__, __name__)
 from datetime import datetime
 import os
+import copy
 import logging
 import tempfile
 import shutil
@@ -23,6 +24,8 @@ import tbx.text
 import uuid as UUID
 import traceback
 from datetime import datetime, timedelta
+from .timing import PhaseTimer, RunProfiler, run_timed
+from .cache import invalidate_document
 
 
 class ConfigurationException(Exception):
@@ -91,6 +94,51 @@ class SerializableQuerySet(mongoengine.QuerySet):
         return [f.to_safe_dict() for f in self]
         #return [public_dict(f) for f in self.as_pymongo()]
 
+    def for_reporting(self):
+        """
+        Routes this queryset to the reporting (read) connection if one is configured, see jobmanager.common.connection.
+        """
+        from jobmanager.common import connection
+        return self.using(connection.reporting_alias())
+
+    def paginate(self, limit=30, token=None, descending=True, field='created'):
+        """
+        Keyset pagination on (field, _id) : every page costs the same as the first one, whatever its depth.
+        Returns the page documents and the opaque token of the next page (None on the last page).
+        """
+        queryset = self.clone()
+        if token:
+            value, last_id = decode_page_token(token)
+            operator = '$lt' if descending else '$gt'
+            queryset = queryset.filter(__raw__={'$or': [
+                {field: {operator: value}},
+                {field: value, '_id': {operator: last_id}},
+            ]})
+        sign = '-' if descending else '+'
+        documents = list(queryset.order_by(sign + field, sign + 'id').limit(limit + 1))
+        next_token = None
+        if len(documents) > limit:
+            documents = documents[:limit]
+            last = documents[-1]
+            next_token = encode_page_token(getattr(last, field), last.pk)
+        return documents, next_token
+
+
+def encode_page_token(value, last_id):
+    import base64
+    from bson import json_util
+    return base64.urlsafe_b64encode(json_util.dumps([value, last_id]).encode()).decode().rstrip('=')
+
+
+def decode_page_token(token):
+    import base64
+    from bson import json_util
+    try:
+        value, last_id = json_util.loads(base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)).decode())
+    except Exception:
+        raise ValueError("Invalid page token '%s'." % token)
+    return value, last_id
+
 
 def safely_import_from_name(modules):
     if modules:
@@ -119,6 +167,8 @@ class BaseDocument(mongoengine.Document):
         'queryset_class': SerializableQuerySet,
         'abstract': True,
         'strict': False,
+        'auto_create_index': False,  # Indexes are built in background at deploy time, see jobmanager.common.indexes
+        'index_background': True,
         'indexes': [
             'created',
         ]
@@ -154,6 +204,8 @@ class NamedDocument(BaseDocument):
         'allow_inheritance': True,
         'queryset_class': SerializableQuerySet,
         'abstract': True,
+        'auto_create_index': False,
+        'index_background': True,
         'indexes': [
             'uuid',
             'created',
@@ -168,6 +220,66 @@ class NamedDocument(BaseDocument):
     def __repr__(self):
         return self.name
 
+    # Opt-in uuid cache, see enable_cache()
+    _uuid_cache = None
+
+    @classmethod
+    def enable_cache(cls, max_size=1000, ttl=60):
+        """
+        Enables the in-process uuid cache of this class (and its subclasses) used by get_by_uuid().
+        Cached documents are shared instances (identity map).
+        """
+        from .cache import DocumentCache
+        cls._uuid_cache = DocumentCache(max_size=max_size, ttl=ttl)
+        return cls._uuid_cache
+
+    @classmethod
+    def disable_cache(cls):
+        cls._uuid_cache = None
+
+    @classmethod
+    def cache_stats(cls):
+        return cls._uuid_cache.stats() if cls._uuid_cache is not None else None
+
+    @classmethod
+    def get_by_uuid(cls, uuid):
+        cache = cls._uuid_cache
+        if cache is None:
+            return cls.objects(uuid=uuid).first()
+        document = cache.get(uuid)
+        if document is None or not isinstance(document, cls):
+            document = cls.objects(uuid=uuid).first()
+            if document is not None:
+                cache.put(uuid, document)
+        return document
+
+    def uncache(self):
+        if self._uuid_cache is not None:
+            self._uuid_cache.invalidate(self.uuid)
+
+    @classmethod
+    def uncache_ids(cls, ids=None):
+        """
+        Invalidates the cached documents of these ids (all of them if ids is None) in this class caches,
+        its parents and subclasses ones. To call after writes that bypass save (queryset updates, modify...).
+        """
+        classes, subclasses = list(cls.__mro__), list(cls.__subclasses__())
+        while subclasses:
+            c = subclasses.pop()
+            classes.append(c)
+            subclasses.extend(c.__subclasses__())
+        caches = {id(c._uuid_cache): c._uuid_cache for c in classes if getattr(c, '_uuid_cache', None) is not None}
+        for cache in caches.values():
+            if ids is None:
+                cache.clear()
+            else:
+                for pk in ids:
+                    cache.invalidate_id(pk)
+
+
+mongoengine.signals.post_save.connect(invalidate_document)
+mongoengine.signals.post_delete.connect(invalidate_document)
+
 
 class LogProxy(object):
 
@@ -254,6 +366,15 @@ class Runnable(TempFolderProxy):
     finished = mongoengine.DateTimeField()
     details = mongoengine.StringField(required=False)
     result = mongoengine.DynamicField(required=False)
+    # Wall/CPU/DB seconds per run phase, saved with the final status (terminal save and cleaning are only sent to hooks)
+    timings = mongoengine.DictField(required=False)
+
+    # Set to a duration in seconds to dump a cProfile stats file for runs slower than it
+    profile_threshold = None
+    profile_folder = None
+
+    # State of the last checkpoint, loaded by run() when a job is resumed (None when starting from scratch)
+    resume_state = None
 
     def process(self, *args, **kwargs):
         raise NotImplementedError('The "process" method shall be subclassed to define the runnable processing.')
@@ -266,6 +387,10 @@ class Runnable(TempFolderProxy):
         self.result = result
         return self.result
 
+    def load_checkpoint(self):
+        # should be overridden by runnables supporting checkpoints
+        return None
+
     def safe_run(self, *args, **kwargs):
         kwargs['safe_run'] = True
         return self.run(*args, **kwargs)
@@ -273,31 +398,65 @@ class Runnable(TempFolderProxy):
     def run(self, *args, **kwargs):
         result = None
         safe_run = kwargs.pop('safe_run', False)
-        self.started = datetime.utcnow()
-        self.status = 'running'
-        self.save()
+        timer = PhaseTimer(self)
+        profiler = None
+        processed = False
         try:
-            self.log_debug("Launching process...")
-            self.pre_process(*args, **kwargs)
-            result = self.process(*args, **kwargs)
-            result = self.post_process(result)  # strangely can be useful
-        except Exception as e:
-            self.log_exception(e)
-            self.details = "Exception : %s" % str(traceback.format_exc())
-            self.status = 'error'
-            self.finished = datetime.utcnow()
-            self.save_as_error()
-            if not safe_run:
-                raise e
-        else:
-            self.status = 'success'
-            self.finished = datetime.utcnow()
-            self.save_as_successful()
+            if self.profile_threshold is not None:
+                profiler = RunProfiler(self.profile_threshold, self.profile_folder)
+                profiler.start()
+            self.started = datetime.utcnow()
+            with timer.phase('save'):
+                running = self.save_as_running()
+            if running is False:
+                self.log_warning("Transition to running refused (changed in database meanwhile), not processing.")
+                return None
+            processed = True
+            try:
+                self.resume_state = self.load_checkpoint()
+                if self.resume_state is not None:
+                    self.log_info("Resuming from last checkpoint.")
+                self.log_debug("Launching process...")
+                with timer.phase('pre_process'):
+                    self.pre_process(*args, **kwargs)
+                with timer.phase('process'):
+                    result = self.process(*args, **kwargs)
+                with timer.phase('post_process'):
+                    result = self.post_process(result)  # strangely can be useful
+            except Exception as e:
+                self.log_exception(e)
+                self.details = "Exception : %s" % str(traceback.format_exc())
+                self.status = 'error'
+                self.finished = datetime.utcnow()
+                self.timings = timer.as_dict()
+                with timer.phase('save_as_error'):
+                    self.save_as_error()
+                if not safe_run:
+                    raise e
+            else:
+                self.status = 'success'
+                self.finished = datetime.utcnow()
+                self.timings = timer.as_dict()
+                with timer.phase('save_as_successful'):
+                    self.save_as_successful()
         finally:
-            self.log_info("Process ended (%s)." % self.status)
-            self.clean_temp()
+            if processed:
+                self.log_info("Process ended (%s)." % self.status)
+            with timer.phase('clean_temp'):
+                self.clean_temp()
+            timings = timer.as_dict()
+            if profiler:
+                profiler.stop(getattr(self, 'uuid', None) or self.__class__.__name__, timings['total'])
+            if processed:
+                run_timed.send(self, timings=timings)
         return result
 
+    def save_as_running(self):
+        # Returns False when the runnable must not be processed (see run)
+        self.status='running'
+        self.save()
+        return True
+
     def save_as_successful(self):
         self.status='success'
         self.save()
@@ -308,10 +467,40 @@ class Runnable(TempFolderProxy):
 
 
 class AutoDocumentable(object):
+    # Generated docs per class, shared between classes for embedded documents.
+    # Reset whenever a new document class gets registered in mongoengine (make_job, job module imports, etc.).
+    _doc_cache = {}
+    _doc_cache_generation = None
+
+    @classmethod
+    def clear_doc_cache(cls):
+        AutoDocumentable._doc_cache.clear()
+        AutoDocumentable._doc_cache_generation = None
+
     @classmethod
     def get_doc(cls):
+        """
+        Returns the documentation of this class fields. The result is a copy, callers may modify it.
+        """
+        return copy.deepcopy(cls._cached_doc())
+
+    @classmethod
+    def _cached_doc(cls):
         import textwrap
+        from mongoengine.base.common import _document_registry
+
+        generation = len(_document_registry)
+        if AutoDocumentable._doc_cache_generation != generation:
+            AutoDocumentable.clear_doc_cache()
+            AutoDocumentable._doc_cache_generation = generation
+        cache = AutoDocumentable._doc_cache
+
         def create_documentation(cls):
+            if cls not in cache:
+                cache[cls] = build_documentation(cls)
+            return cache[cls]
+
+        def build_documentation(cls):
             result = {
                 "class": cls.__name__,
                 "doc": textwrap.dedent(cls.__doc__) if cls.__doc__ else '',
@@ -388,3 +577,18 @@ class AutoDocumentable(object):
 
         return create_documentation(cls)
 
+    @classmethod
+    def get_all_docs(cls):
+        """
+        Returns the docs of this class and all of its subclasses, by class name, in one pass.
+        The result is a copy, in which sub-documents common to several classes are still shared.
+        """
+        docs = {}
+        classes = [cls]
+        while classes:
+            doc_class = classes.pop()
+            if doc_class.__name__ not in docs:
+                docs[doc_class.__name__] = doc_class._cached_doc()
+                classes.extend(doc_class.__subclasses__())
+        return copy.deepcopy(docs)
+
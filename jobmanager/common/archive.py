@@ -0,0 +1,208 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# vim: ai ts=4 sts=4 et sw=4 nu
+"""
+(c) 2018 Ronan Delacroix
+Job Manager Cold archival of finished jobs
+:author: Ronan Delacroix
+
+Finished jobs (history included, as it is embedded) are moved from the jobs collection into compressed segment files.
+A small sqlite manifest indexes the archived jobs by uuid, class and finish date.
+"""
+import os
+import gzip
+import sqlite3
+import threading
+from datetime import datetime, timedelta
+from bson import json_util, ObjectId
+import jobmanager.common as common
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+FINISHED_STATUSES = ('success', 'error')
+
+
+def _msgpack_default(obj):
+    if isinstance(obj, datetime):
+        return msgpack.ExtType(1, json_util.dumps(obj).encode())
+    if isinstance(obj, ObjectId):
+        return msgpack.ExtType(2, obj.binary)
+    raise TypeError("Unknown type: %r" % obj)
+
+
+def _msgpack_ext_hook(code, data):
+    if code == 1:
+        return json_util.loads(data.decode())
+    if code == 2:
+        return ObjectId(data)
+    return msgpack.ExtType(code, data)
+
+
+class SegmentFormat(object):
+    extension = None
+
+    def write(self, filename, documents):
+        raise NotImplementedError()
+
+    def read(self, filename):
+        raise NotImplementedError()
+
+
+class JsonLinesFormat(SegmentFormat):
+    extension = '.jsonl.gz'
+
+    def write(self, filename, documents):
+        with gzip.open(filename, 'wt', encoding='utf-8') as f:
+            for document in documents:
+                f.write(json_util.dumps(document))
+                f.write('\n')
+
+    def read(self, filename):
+        with gzip.open(filename, 'rt', encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    yield json_util.loads(line)
+
+
+class MsgpackFormat(SegmentFormat):
+    extension = '.msgpack.gz'
+
+    def __init__(self):
+        if msgpack is None:
+            raise common.ConfigurationException("msgpack is not installed, it is required for the msgpack archive format.")
+
+    def write(self, filename, documents):
+        with gzip.open(filename, 'wb') as f:
+            for document in documents:
+                f.write(msgpack.packb(document, default=_msgpack_default, use_bin_type=True))
+
+    def read(self, filename):
+        with gzip.open(filename, 'rb') as f:
+            for document in msgpack.Unpacker(f, ext_hook=_msgpack_ext_hook, raw=False):
+                yield document
+
+
+SEGMENT_FORMATS = {
+    'jsonl': JsonLinesFormat,
+    'msgpack': MsgpackFormat,
+}
+
+
+class JobArchive(common.LogProxy):
+
+    def __init__(self, folder, segment_format='jsonl'):
+        if segment_format not in SEGMENT_FORMATS:
+            raise common.ConfigurationException("Unknown archive format '%s'." % segment_format)
+        self.folder = folder
+        self.format = SEGMENT_FORMATS[segment_format]()
+        os.makedirs(self.folder, exist_ok=True)
+        self._lock = threading.Lock()
+        self._manifest = sqlite3.connect(os.path.join(self.folder, 'manifest.sqlite'), check_same_thread=False)
+        with self._manifest:
+            self._manifest.execute("CREATE TABLE IF NOT EXISTS jobs "
+                                   "(uuid TEXT PRIMARY KEY, cls TEXT, finished TIMESTAMP, segment TEXT)")
+            self._manifest.execute("CREATE INDEX IF NOT EXISTS jobs_finished ON jobs (finished)")
+            self._manifest.execute("CREATE INDEX IF NOT EXISTS jobs_cls ON jobs (cls, finished)")
+
+    def archive(self, older_than=timedelta(days=30), batch_size=1000):
+        """
+        Moves the jobs finished before 'older_than' (a timedelta or a datetime) into segments of batch_size jobs.
+        Segment file and manifest are written before the jobs are removed from the database.
+        Returns the amount of archived jobs.
+        """
+        from jobmanager.common.job import Job
+        cutoff = older_than if isinstance(older_than, datetime) else datetime.utcnow() - older_than
+        collection = Job._get_collection()
+        query = {'status': {'$in': list(FINISHED_STATUSES)}, 'finished': {'$lt': cutoff}}
+        total = 0
+        while True:
+            documents = list(collection.find(query).sort('finished', 1).limit(batch_size))
+            if not documents:
+                break
+            segment = self._write_segment(documents)
+            ids = [d['_id'] for d in documents]
+            # Jobs requeued since they were read no longer match the query : they stay live, out of the manifest
+            deleted = collection.delete_many(dict(query, _id={'$in': ids})).deleted_count
+            if deleted < len(documents):
+                kept = [d['uuid'] for d in collection.find({'_id': {'$in': ids}}, {'uuid': 1})]
+                self._unlist(kept, segment)
+                self.log_warning("%d jobs changed meanwhile, not archived." % len(kept))
+            total += deleted
+            self.log_info("%d jobs archived in %s." % (deleted, segment))
+        return total
+
+    def _write_segment(self, documents):
+        name = "segment_%s_%s%s" % (datetime.utcnow().strftime('%Y%m%d%H%M%S%f'), documents[0]['uuid'], self.format.extension)
+        filename = os.path.join(self.folder, name)
+        self.format.write(filename + '.tmp', documents)
+        os.rename(filename + '.tmp', filename)
+        with self._lock, self._manifest:
+            self._manifest.executemany(
+                "INSERT OR REPLACE INTO jobs (uuid, cls, finished, segment) VALUES (?, ?, ?, ?)",
+                [(d['uuid'], d.get('_cls'), d.get('finished'), name) for d in documents]
+            )
+        return name
+
+    def _unlist(self, uuids, segment):
+        with self._lock, self._manifest:
+            self._manifest.executemany("DELETE FROM jobs WHERE uuid = ? AND segment = ?", [(u, segment) for u in uuids])
+
+    def find(self, uuid):
+        """
+        Returns the raw archived job document, or None.
+        """
+        with self._lock:
+            row = self._manifest.execute("SELECT segment FROM jobs WHERE uuid = ?", (uuid,)).fetchone()
+        if not row:
+            return None
+        for document in self.format.read(os.path.join(self.folder, row[0])):
+            if document.get('uuid') == uuid:
+                return document
+        return None
+
+    def get(self, uuid):
+        """
+        Returns the archived job as a Job instance, or None.
+        """
+        from jobmanager.common.job import Job
+        document = self.find(uuid)
+        if document is None:
+            return None
+        return Job._from_son(document)
+
+    def list(self, cls=None, finished_after=None, finished_before=None, limit=100):
+        """
+        Lists manifest entries as (uuid, class, finished, segment) tuples, latest first.
+        """
+        conditions, parameters = [], []
+        if cls:
+            conditions.append("cls = ?")
+            parameters.append(cls)
+        if finished_after:
+            conditions.append("finished >= ?")
+            parameters.append(finished_after)
+        if finished_before:
+            conditions.append("finished < ?")
+            parameters.append(finished_before)
+        where = ("WHERE " + " AND ".join(conditions)) if conditions else ""
+        with self._lock:
+            return self._manifest.execute(
+                "SELECT uuid, cls, finished, segment FROM jobs %s ORDER BY finished DESC LIMIT ?" % where,
+                parameters + [limit]
+            ).fetchall()
+
+
+default_archive = None
+
+
+def set_default_archive(folder, segment_format='jsonl'):
+    """
+    Sets the archive used as a fallback by Job.from_uuid().
+    """
+    global default_archive
+    default_archive = JobArchive(folder, segment_format=segment_format) if folder else None
+    return default_archive
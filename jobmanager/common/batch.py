@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# vim: ai ts=4 sts=4 et sw=4 nu
+"""
+(c) 2018 Ronan Delacroix
+Job Manager Micro-batched execution of small jobs
+:author: Ronan Delacroix
+
+A worker claims up to N pending jobs of the same class at once (two writes whatever N), runs them back to back
+in process, without intermediate saves, then commits every status transition and result with a single bulk_write.
+Only worth it for job classes returning more than 1 from Job.default_batch_size().
+Batched jobs are saved with their changed fields (process() results included), but their save_as_successful /
+save_as_error overrides are not called : job classes relying on those shall not enable batching.
+"""
+import traceback
+from datetime import datetime
+import pymongo
+import tbx.text
+from jobmanager.common.timing import PhaseTimer, run_timed
+from jobmanager.common.scheduling import CLAIM_ORDER
+
+
+def claim_batch(hostname, job_class, size=None):
+    """
+    Claims up to 'size' pending jobs of job_class for hostname. Returns the claimed jobs.
+    Jobs are marked with a batch id so concurrent claimers never get the same job.
+    job_class is a Job subclass or a class name (see registry.JobTypeRegistry.resolve).
+    """
+    from jobmanager.common.registry import job_types
+    job_class = job_types.resolve(job_class)
+    size = size or job_class.default_batch_size()
+    ids = [d['_id'] for d in job_class.objects(status='pending').order_by(*CLAIM_ORDER).limit(size).only('id').as_pymongo()]
+    if not ids:
+        return []
+    batch = tbx.text.random_short_slug()
+    job_class.objects(id__in=ids, status='pending').update(
+        set__status='running',
+        set__hostname=hostname,
+        set__started=datetime.utcnow(),
+        set__batch=batch,
+    )
+    job_class.uncache_ids(ids)
+    return list(job_class.objects(id__in=ids, batch=batch).order_by(*CLAIM_ORDER))
+
+
+def run_job(job, *args, **kwargs):
+    """
+    Runs one job of a batch in memory : same phases as Runnable.run, without any database write.
+    """
+    timer = PhaseTimer(job)
+    result = None
+    try:
+        with timer.phase('pre_process'):
+            job.pre_process(*args, **kwargs)
+        with timer.phase('process'):
+            result = job.process(*args, **kwargs)
+        with timer.phase('post_process'):
+            result = job.post_process(result)
+    except Exception as e:
+        job.log_exception(e)
+        job.details = "Exception : %s" % str(traceback.format_exc())
+        job.status = 'error'
+        job.status_text = "Job Error"
+    else:
+        job.status = 'success'
+        job.completion = 100
+        job.status_text = "Job Successful"
+    job.finished = datetime.utcnow()
+    job.updated = job.finished
+    job.log_info("Process ended (%s)." % job.status)
+    with timer.phase('clean_temp'):
+        job.clean_temp()
+    job.timings = timer.as_dict()
+    return result
+
+
+def run_batch(jobs, *args, **kwargs):
+    """
+    Runs the claimed jobs back to back and commits all of them with one bulk_write.
+    Jobs no longer running in this batch in database (cancelled or requeued meanwhile) are logged and skipped.
+    Returns the results list, in jobs order.
+    """
+    if not jobs:
+        return []
+    results = [run_job(job, *args, **kwargs) for job in jobs]
+    histories = [job.history_entry() for job in jobs]
+    updates = [job.delta_update(history=history) for job, history in zip(jobs, histories)]
+    written = jobs[0]._get_collection().bulk_write(
+        [pymongo.UpdateOne({'_id': job.pk, 'status': 'running', 'batch': job.batch}, update)
+         for job, update in zip(jobs, updates)],
+        ordered=False
+    )
+    committed = set(job.pk for job in jobs)
+    if written.matched_count < len(jobs):
+        committed = committed_ids(jobs)
+    for job, update, history in zip(jobs, updates, histories):
+        if job.pk not in committed:
+            job.log_warning("Status changed in database meanwhile, transition to '%s' not saved." % job.status)
+            continue
+        job.delta_saved(update, history=history)
+        run_timed.send(job, timings=job.timings)
+    return results
+
+
+def committed_ids(jobs):
+    """
+    Returns the ids of the jobs whose batch commit was applied : the ones holding their own 'updated' date
+    (stored with millisecond precision), the others were cancelled or requeued meanwhile.
+    """
+    expected = {job.pk: job.updated.replace(microsecond=job.updated.microsecond // 1000 * 1000) for job in jobs}
+    documents = jobs[0]._get_collection().find({'_id': {'$in': list(expected)}}, {'updated': 1})
+    return set(d['_id'] for d in documents if d.get('updated') == expected[d['_id']])
+
+
+def claim_and_run_batch(hostname, job_class, size=None):
+    jobs = claim_batch(hostname, job_class, size=size)
+    run_batch(jobs)
+    return jobs
@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# vim: ai ts=4 sts=4 et sw=4 nu
+"""
+(c) 2018 Ronan Delacroix
+Job Manager In-process document cache
+:author: Ronan Delacroix
+
+Opt-in identity map + LRU cache of named documents by uuid (see NamedDocument.enable_cache / get_by_uuid).
+Entries expire after 'ttl' seconds, and are invalidated on local saves, deletes, transitions and direct updates
+(claims, batch claims, checkpoints, aging : see NamedDocument.uncache_ids).
+watch_changes() optionally invalidates entries from the database change stream (replica set needed),
+so changes made by other processes are seen before the ttl expires.
+"""
+import time
+import logging
+import threading
+from collections import OrderedDict
+
+
+class DocumentCache(object):
+
+    def __init__(self, max_size=1000, ttl=60):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.ids = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is None or time.time() - entry[1] > self.ttl:
+                if entry is not None:
+                    self._remove(key)
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, document):
+        with self._lock:
+            if key in self.entries:
+                self._remove(key)
+            self.entries[key] = (document, time.time())
+            if document.pk is not None:
+                self.ids[document.pk] = key
+            while len(self.entries) > self.max_size:
+                self._remove(next(iter(self.entries)))
+                self.evictions += 1
+
+    def _remove(self, key):
+        document, stored = self.entries.pop(key)
+        self.ids.pop(document.pk, None)
+
+    def invalidate(self, key):
+        with self._lock:
+            if key in self.entries:
+                self._remove(key)
+
+    def invalidate_id(self, pk):
+        with self._lock:
+            key = self.ids.get(pk)
+            if key is not None:
+                self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self.entries.clear()
+            self.ids.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self.entries),
+                'max_size': self.max_size,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_ratio': (self.hits / float(lookups)) if lookups else None,
+            }
+
+
+def invalidate_document(sender, document, **kwargs):
+    cache = getattr(document, '_uuid_cache', None)
+    if cache is not None and getattr(document, 'uuid', None):
+        cache.invalidate(document.uuid)
+
+
+def watch_changes(document_class):
+    """
+    Invalidates document_class cache entries on every update, replace or delete seen in the collection change stream.
+    Runs in a daemon thread, returns it.
+    """
+    cache = document_class._uuid_cache
+    if cache is None:
+        raise ValueError("Cache not enabled on %s." % document_class.__name__)
+
+    def watch():
+        pipeline = [{'$match': {'operationType': {'$in': ['update', 'replace', 'delete']}}}]
+        while True:
+            try:
+                with document_class._get_collection().watch(pipeline) as stream:
+                    for change in stream:
+                        cache.invalidate_id(change['documentKey']['_id'])
+            except Exception as e:
+                logging.warning("%s cache change stream interrupted (%s), clearing cache and retrying." % (document_class.__name__, e))
+                cache.clear()
+                time.sleep(5)
+
+    thread = threading.Thread(target=watch, name='%s-cache-watch' % document_class.__name__)
+    thread.daemon = True
+    thread.start()
+    return thread
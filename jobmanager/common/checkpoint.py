@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# vim: ai ts=4 sts=4 et sw=4 nu
+"""
+(c) 2018 Ronan Delacroix
+Job Manager Checkpoint blob stores
+:author: Ronan Delacroix
+
+Job checkpoints small enough are stored inline in the job document, larger ones go to a blob store as extended JSON
+(checkpoints are never pickled : anyone able to write a job document could otherwise run code on workers).
+The default blob store is GridFS (shared by every host, so a job can resume on another machine).
+"""
+import os
+import gridfs
+
+
+class BlobStore(object):
+
+    def put(self, key, data):
+        raise NotImplementedError()
+
+    def get(self, key):
+        raise NotImplementedError()
+
+    def delete(self, key):
+        raise NotImplementedError()
+
+
+class GridFSBlobStore(BlobStore):
+
+    def __init__(self, collection='checkpoints', alias='default'):
+        self.collection = collection
+        self.alias = alias
+        self._fs = None
+
+    @property
+    def fs(self):
+        if self._fs is None:
+            import mongoengine.connection
+            self._fs = gridfs.GridFS(mongoengine.connection.get_db(self.alias), collection=self.collection)
+        return self._fs
+
+    def put(self, key, data):
+        file_id = self.fs.put(data, filename=key)
+        for old in self.fs.find({'filename': key, '_id': {'$ne': file_id}}):
+            self.fs.delete(old._id)
+
+    def get(self, key):
+        try:
+            return self.fs.get_last_version(filename=key).read()
+        except gridfs.NoFile:
+            return None
+
+    def delete(self, key):
+        for old in self.fs.find({'filename': key}):
+            self.fs.delete(old._id)
+
+
+class FileBlobStore(BlobStore):
+    """
+    Stores blobs in a folder, that should be shared between hosts (NFS, etc.) for jobs to resume anywhere.
+    """
+
+    def __init__(self, folder):
+        self.folder = folder
+        os.makedirs(self.folder, exist_ok=True)
+
+    def path(self, key):
+        return os.path.join(self.folder, key)
+
+    def put(self, key, data):
+        with open(self.path(key) + '.tmp', 'wb') as f:
+            f.write(data)
+        os.replace(self.path(key) + '.tmp', self.path(key))
+
+    def get(self, key):
+        try:
+            with open(self.path(key), 'rb') as f:
+                return f.read()
+        except (IOError, OSError):
+            return None
+
+    def delete(self, key):
+        try:
+            os.remove(self.path(key))
+        except (IOError, OSError):
+            pass
+
+
+blob_store = GridFSBlobStore()
+
+
+def set_blob_store(store):
+    global blob_store
+    blob_store = store
+    return blob_store
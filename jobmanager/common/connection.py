@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# vim: ai ts=4 sts=4 et sw=4 nu
+"""
+(c) 2018 Ronan Delacroix
+Job Manager Connection and read routing
+:author: Ronan Delacroix
+
+Two connection aliases with their own pool and settings :
+- the default alias, for claims, progress updates and every write (primary, driver default write concern,
+  pass e.g. write_options={'w': 'majority'} to connect() for stronger durability),
+- the reporting alias, for dashboard reads (history, listings, json exports) on secondaries when available.
+
+Querysets are routed per call with SerializableQuerySet.for_reporting(), which falls back to the default alias
+when no reporting connection is configured.
+"""
+import logging
+import mongoengine
+import mongoengine.connection
+
+
+WRITE_ALIAS = mongoengine.DEFAULT_CONNECTION_NAME
+READ_ALIAS = 'jobmanager-reporting'
+
+WRITE_OPTIONS = {
+    'maxPoolSize': 50,
+    'connectTimeoutMS': 5000,
+    'serverSelectionTimeoutMS': 10000,
+    'socketTimeoutMS': 30000,
+    'retryWrites': True,
+}
+
+READ_OPTIONS = {
+    'maxPoolSize': 20,
+    'connectTimeoutMS': 5000,
+    'serverSelectionTimeoutMS': 10000,
+    'socketTimeoutMS': 60000,
+    'readPreference': 'secondaryPreferred',
+    'maxStalenessSeconds': 120,
+}
+
+
+def connect(host='mongodb://localhost/jobmanager', read_host=None, write_options=None, read_options=None, reporting=True):
+    """
+    Connects the default (write) alias and, unless reporting is False, the reporting (read) alias.
+    read_host defaults to host : the read preference sends reporting reads to secondaries of the same replica set.
+    Options override WRITE_OPTIONS / READ_OPTIONS (any pymongo MongoClient option).
+    """
+    options = dict(WRITE_OPTIONS, **(write_options or {}))
+    connection = mongoengine.connect(host=host, alias=WRITE_ALIAS, **options)
+    logging.info("Database connection '%s' ready." % WRITE_ALIAS)
+    if reporting:
+        options = dict(READ_OPTIONS, **(read_options or {}))
+        mongoengine.connect(host=read_host or host, alias=READ_ALIAS, **options)
+        logging.info("Database connection '%s' ready." % READ_ALIAS)
+    return connection
+
+
+def disconnect():
+    for alias in (READ_ALIAS, WRITE_ALIAS):
+        mongoengine.connection.disconnect(alias)
+
+
+def has_reporting_alias():
+    return READ_ALIAS in mongoengine.connection._connection_settings
+
+
+def reporting_alias():
+    """
+    Returns the alias reporting reads shall use.
+    """
+    return READ_ALIAS if has_reporting_alias() else WRITE_ALIAS
@@ -5,17 +5,40 @@
 :Author: Ronan Delacroix
 :Copyright: (c) 2018 Ronan Delacroix
 """
+import hashlib
+from datetime import datetime
 import mongoengine
 import jobmanager.common
 
 
+def normalize_lines(lines):
+    return sorted({' '.join(l.split()) for l in lines or [] if l and l.strip()})
+
+
+def content_hash(requirements=None, apt_packages=None, dockerfile=None):
+    """
+    Returns the hash identifying an image content : requirements and apt packages are sorted and deduplicated,
+    Dockerfile blank lines and extra spaces are ignored.
+    """
+    dockerfile_lines = [' '.join(l.split()) for l in (dockerfile or '').splitlines() if l.strip()]
+    content = '\n'.join(
+        ['[requirements]'] + normalize_lines(requirements) +
+        ['[apt_packages]'] + normalize_lines(apt_packages) +
+        ['[dockerfile]'] + dockerfile_lines
+    )
+    return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+
 class DockerImage(jobmanager.common.NamedDocument):
     meta = {
         'queryset_class': jobmanager.common.SerializableQuerySet,
         'indexes': [
             'uuid',
             'created',
-            'name'
+            'name',
+            'jobs',
+            'tasks',
+            'last_used',
         ]
     }
     name = mongoengine.StringField(required=True)
@@ -27,3 +50,46 @@ class DockerImage(jobmanager.common.NamedDocument):
     requirements = mongoengine.ListField(field=mongoengine.StringField())
     apt_packages = mongoengine.ListField(field=mongoengine.StringField())
     dockerfile = mongoengine.StringField()
+    content_hash = mongoengine.StringField(unique=True, sparse=True)
+    last_used = mongoengine.DateTimeField()
+    use_count = mongoengine.IntField(default=0)
+
+    def clean(self):
+        # Images only known by url / image_id have no content : no hash, so the sparse unique index ignores them
+        has_content = self.requirements or self.apt_packages or (self.dockerfile or '').strip()
+        self.content_hash = content_hash(self.requirements, self.apt_packages, self.dockerfile) if has_content else None
+
+    @classmethod
+    def find_by_content(cls, requirements=None, apt_packages=None, dockerfile=None):
+        """
+        Returns the already built image having exactly this content, or None (then it needs to be built).
+        """
+        if not (requirements or apt_packages or (dockerfile or '').strip()):
+            return None
+        return cls.objects(content_hash=content_hash(requirements, apt_packages, dockerfile)).first()
+
+    @classmethod
+    def for_job(cls, job_class_name):
+        """
+        Returns the images able to run this job class, most recently used first.
+        """
+        return cls.objects(jobs=job_class_name).order_by('-last_used')
+
+    @classmethod
+    def for_task(cls, task_class_name):
+        return cls.objects(tasks=task_class_name).order_by('-last_used')
+
+    def touch(self):
+        """
+        Records an image use, for LRU pruning.
+        """
+        self.last_used = datetime.utcnow()
+        self.update(set__last_used=self.last_used, inc__use_count=1)
+        self.uncache()
+
+    @classmethod
+    def prune_candidates(cls, keep=10):
+        """
+        Returns the images that local pruning may remove : all but the 'keep' most recently used ones.
+        """
+        return cls.objects.order_by('-last_used').skip(keep)
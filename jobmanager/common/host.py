@@ -8,7 +8,10 @@ Job Manager Host
 """
 import os
 import sys
+import json
+import hashlib
 import logging
+import warnings
 import socket
 import tbx.code
 from datetime import datetime, timedelta
@@ -21,6 +24,71 @@ import jobmanager
 import jobmanager.common as common
 
 
+MEMORY_KEYS = ('total', 'used', 'percent')
+STATUS_DICTIONARY_LIMIT = 500  # Entries per kind
+STATUS_DICTIONARY_TOUCH = timedelta(hours=1)  # Last use of entries is written (and eviction tried) at most that often
+
+
+def status_key(entry):
+    """
+    Returns the key of a status dictionary entry : a hash of its content, the same in every process.
+    """
+    return hashlib.sha1(json.dumps(entry, sort_keys=True).encode('utf-8')).hexdigest()[:16]
+
+
+def pack_system_status(system_status, ref):
+    """
+    Packs a system status in a compact form : numbers arrays, no repeated keys, partitions and process command lines
+    replaced by their key in the host status dictionary (see Host.status_ref).
+    """
+    memory = system_status['memory']
+    return {
+        'v': 1,
+        'c': system_status['cpu']['percent'],
+        'cs': system_status['cpu']['percents'],
+        'm': [memory['virtual'][k] for k in MEMORY_KEYS] + [memory['swap'][k] for k in MEMORY_KEYS],
+        'd': [[ref('d', [p['type'], p['device'], p['mountpoint'], p['total']]), p['used'], p['percent']]
+              for p in system_status['disk']],
+        'p': [[ref('p', p['cmd']), p['ppid'], p['pid']] for p in system_status['processes']],
+    }
+
+
+def unpack_system_status(packed, dictionary):
+    """
+    Rebuilds the system status, as stored before packing, from a packed one and the host status dictionary.
+    """
+    def lookup(kind, ref, missing):
+        if isinstance(ref, dict):  # Inlined, the dictionary was full
+            return ref.get('i', missing)
+        entry = (dictionary.get(kind) or {}).get(ref)
+        return entry['e'] if entry else missing
+
+    memory = packed.get('m') or [None] * 6
+    partitions = []
+    for ref, used, percent in packed.get('d', []):
+        fstype, device, mountpoint, total = lookup('d', ref, [None] * 4)
+        partitions.append({
+            'type': fstype,
+            'device': device,
+            'mountpoint': mountpoint,
+            'total': total,
+            'used': used,
+            'percent': percent,
+        })
+    return {
+        'processes': [{'ppid': ppid, 'pid': pid, 'cmd': lookup('p', ref, None)} for ref, ppid, pid in packed.get('p', [])],
+        'cpu': {
+            'percent': packed.get('c'),
+            'percents': packed.get('cs', []),
+        },
+        'memory': {
+            'virtual': dict(zip(MEMORY_KEYS, memory[0:3])),
+            'swap': dict(zip(MEMORY_KEYS, memory[3:6])),
+        },
+        'disk': partitions,
+    }
+
+
 class Host(common.BaseDocument):
     meta = {
         'ordering': ['-updated'],
@@ -40,13 +108,86 @@ class Host(common.BaseDocument):
     boot_time = mongoengine.DateTimeField()
     python_version = mongoengine.StringField()
     python_packages = mongoengine.ListField(field=mongoengine.StringField())
+    # Partitions and process command lines referenced from packed statuses : {kind: {key: {'e': entry, 'u': last use}}}
+    status_dictionary = mongoengine.DictField(default={})
+
+    # Store statuses packed (see pack_system_status) rather than as verbose dicts
+    compact_status = True
+
+    def oldest_status_date(self):
+        oldest = HostStatus.objects(host=self).order_by('+created').only('created').first()
+        return oldest.created if oldest else None
+
+    def evict_status_entries(self, kind, now):
+        """
+        Removes the entries that no retained status references any more : the ones last used before the oldest
+        status of this host still in the (capped) collection. Tried at most every STATUS_DICTIONARY_TOUCH.
+        """
+        tried = getattr(self, '_status_eviction', {})
+        if tried.get(kind) and now - tried[kind] < STATUS_DICTIONARY_TOUCH:
+            return
+        tried[kind] = now
+        self._status_eviction = tried
+        oldest = self.oldest_status_date()
+        entries = self.status_dictionary[kind]
+        # Last uses are written at most every STATUS_DICTIONARY_TOUCH : an entry may be used up to that much later
+        for stale in [k for k, e in entries.items() if oldest is None or e['u'] + STATUS_DICTIONARY_TOUCH < oldest]:
+            del entries[stale]
+            self._status_dictionary_updates['$unset']['status_dictionary.%s.%s' % (kind, stale)] = ''
 
-    def history(self, offset=0, limit=30, step=0):
+    def status_ref(self, kind, entry):
+        """
+        Returns the key of entry in the status dictionary, adding it if needed.
+        Changes are collected in _status_dictionary_updates and written per key by save_status_dictionary,
+        so concurrent writers never overwrite each other entries.
+        Once the dictionary is full of entries still referenced, the entry is returned inlined as {'i': entry}.
+        """
+        now = datetime.utcnow()
+        updates = self._status_dictionary_updates
+        entries = self.status_dictionary.setdefault(kind, {})
+        key = status_key(entry)
+        path = 'status_dictionary.%s.%s' % (kind, key)
+        if key in entries:
+            if now - entries[key]['u'] > STATUS_DICTIONARY_TOUCH:
+                entries[key]['u'] = now
+                updates['$set'][path + '.u'] = now
+            return key
+        if len(entries) >= STATUS_DICTIONARY_LIMIT:
+            self.evict_status_entries(kind, now)
+            if len(entries) >= STATUS_DICTIONARY_LIMIT:
+                return {'i': entry}
+        entries[key] = {'e': entry, 'u': now}
+        updates['$unset'].pop(path, None)
+        updates['$set'][path] = {'e': entry, 'u': now}
+        return key
+
+    def save_status_dictionary(self):
+        updates = {operator: fields for operator, fields in self._status_dictionary_updates.items() if fields}
+        if updates:
+            self.update(__raw__=updates)
+        # Already written : keep the dictionary out of the next save delta
+        self._changed_fields = [f for f in self._changed_fields if f.split('.')[0] != 'status_dictionary']
+        self._status_dictionary_updates = {'$set': {}, '$unset': {}}
+
+    def history(self, offset=0, limit=30, step=0, token=None):
+        return self.history_page(offset=offset, limit=limit, step=step, token=token)[0]
+
+    def history_page(self, offset=0, limit=30, step=0, token=None):
+        """
+        Returns a page of statuses (latest first) and the token of the next page.
+        Use the token rather than offset : offset relies on a skip that gets slower the deeper the page is.
+        Deprecated offset keeps its original meaning : statuses from offset to limit (slice end), no next token.
+        """
         step_filter = {}
         if step and step > 1:
             step_filter = {'index__mod':(step,0)}
-        statuses = HostStatus.objects(host=self, **step_filter).order_by('-created')[offset:limit]
-        return [s.to_safe_dict(with_host=False) for s in statuses]
+        statuses = HostStatus.objects(host=self, **step_filter).for_reporting()
+        if offset and not token:
+            warnings.warn("Host history offset is deprecated, use the page token instead.", DeprecationWarning, stacklevel=3)
+            statuses = statuses.order_by('-created')[offset:limit]
+            return [s.to_safe_dict(with_host=False, dictionary=self.status_dictionary) for s in statuses], None
+        statuses, next_token = statuses.paginate(limit=limit, token=token)
+        return [s.to_safe_dict(with_host=False, dictionary=self.status_dictionary) for s in statuses], next_token
 
     def alive(self):
         recent_count = HostStatus.objects(host=self, created__gte=datetime.utcnow() - timedelta(minutes=0.5)).count()
@@ -58,13 +199,14 @@ class Host(common.BaseDocument):
             return None
         return last_status.created
 
-    def to_safe_dict(self, alive=False, with_history=False, offset=0, limit=30, step=0):
+    def to_safe_dict(self, alive=False, with_history=False, offset=0, limit=30, step=0, token=None):
         r = super(Host, self).to_safe_dict()
+        r.pop('status_dictionary', None)
         if alive:
             r['alive'] = self.alive()
             r['last_seen_alive'] = self.last_seen_alive()
         if with_history:
-            r['history'] = self.history(offset=offset, limit=limit, step=step)
+            r['history'], r['history_next'] = self.history_page(offset=offset, limit=limit, step=step, token=token)
         return r
 
     def update_status(self):
@@ -102,7 +244,7 @@ class Host(common.BaseDocument):
         virtual_memory = psutil.virtual_memory()
         swap_memory = psutil.swap_memory()
 
-        status.system_status = {
+        system_status = {
             'processes': processes,
             'cpu': {
                 'percent': psutil.cpu_percent(),
@@ -123,10 +265,22 @@ class Host(common.BaseDocument):
             'disk': partitions,
             #'disk_io': safe_dict(psutil.disk_io_counters, perdisk=False)
         }
+        if self.compact_status:
+            self._status_dictionary_updates = {'$set': {}, '$unset': {}}
+            status.packed = pack_system_status(system_status, self.status_ref)
+            self.save_status_dictionary()
+        else:
+            status.system_status = system_status
         status.save()
 
     @classmethod
-    def localhost(cls):
+    def localhost(cls, job_types_manifest=None):
+        """
+        Returns this machine Host, creating it if needed, once the job type registry is populated
+        (entry points and the optional job_types_manifest file, see registry.JobTypeRegistry).
+        """
+        from jobmanager.common.registry import job_types
+        job_types.populate(job_types_manifest)
         hostname = socket.gethostname()
         hosts = Host.objects(hostname=hostname)
         if not hosts:
@@ -156,12 +310,16 @@ class Host(common.BaseDocument):
 
     def update_slots(self, job_slots=None):
         from jobmanager.common.job import Job, JobTask
+        from jobmanager.common.registry import job_types
+        job_types.populate()
         job_classes = tbx.code.get_subclasses(Job)
         job_tasks = tbx.code.get_subclasses(JobTask)
+        available_class_names = {c.__name__ for c in job_classes} | job_types.names()
         if not job_slots:
             logging.info('Job Slots not set in env or command line args. Setting to default job defined amount.')
             job_slots = {k.__name__: k.default_slot_amount() for k in job_classes}
-        available_class_names = {c.__name__ for c in job_classes}
+            for class_name in job_types.names() - set(job_slots.keys()):
+                job_slots[class_name] = job_types.default_slot_amount(class_name)
         previous_class_names = set(self.job_slots.keys())
         all_class_names = previous_class_names | available_class_names
         for class_name in all_class_names:
@@ -195,32 +353,71 @@ class Host(common.BaseDocument):
     def do_import(self, imports):
         return common.safely_import_from_name(imports)
 
+    def load_job_types(self):
+        """
+        Imports, through the job type registry, only the job classes this host has slots for.
+        """
+        from jobmanager.common.registry import job_types
+        names = [c for c, slots in self.job_slots.items() if slots and c in job_types.names()]
+        return job_types.load(names)
+
     @classmethod
     def get_all_alive(cls):
         raise NotImplementedError()
 
 
+class HostStatusQuerySet(common.SerializableQuerySet):
+
+    def to_safe_dict(self):
+        """
+        Reads the raw statuses (loading documents would fetch their host) and the status dictionaries of their hosts
+        in one query, rather than one host per status.
+        """
+        statuses = list(self.as_pymongo())
+        host_ids = set(s['host']['_id'] for s in statuses if s.get('host'))
+        dictionaries = {h.pk: h.status_dictionary for h in Host.objects(id__in=host_ids).only('status_dictionary')}
+        return [
+            safe_status_dict(common.public_dict(s), dictionary=dictionaries.get(s['host']['_id']) if s.get('host') else None)
+            for s in statuses
+        ]
+
+
 class HostStatus(common.BaseDocument):
 
     meta = {
         'ordering': ['-created'],
         'max_documents': 200000,
         'max_size': 200000000,
-        'queryset_class': common.SerializableQuerySet,
+        'queryset_class': HostStatusQuerySet,
         'indexes': [
             'created',
-            'host'
+            'host',
+            {'fields': ['host.id', '-created', '-id'], 'name': 'host_created_id_desc'},  # History pages, see paginate
         ]
     }
     host = mongoengine.CachedReferenceField(Host, fields=['hostname'], reverse_delete_rule=mongoengine.CASCADE)
     index = mongoengine.LongField(required=True, default=0)
     system_status = mongoengine.DictField(default={})
+    packed = mongoengine.DictField()  # Compact system status, see pack_system_status
     current_jobs = mongoengine.ListField(field=mongoengine.DictField(), default=[])
     updated = None
 
-    def to_safe_dict(self, with_host=True):
+    def to_safe_dict(self, with_host=True, dictionary=None):
         r = super(HostStatus, self).to_safe_dict()
-        if not with_host:
-            del r['host']
-            del r['type']
-        return r
+        if r.get('packed') and dictionary is None:
+            host = Host.objects(id=self._data['host'].pk).only('status_dictionary').first() if self._data.get('host') else None
+            dictionary = host.status_dictionary if host else {}
+        return safe_status_dict(r, with_host=with_host, dictionary=dictionary)
+
+
+def safe_status_dict(r, with_host=True, dictionary=None):
+    """
+    Finishes a status safe dict : unpacks its packed system status with the host status dictionary.
+    """
+    packed = r.pop('packed', None)
+    if packed:
+        r['system_status'] = unpack_system_status(packed, dictionary or {})
+    if not with_host:
+        del r['host']
+        del r['type']
+    return r
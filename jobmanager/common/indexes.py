@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# vim: ai ts=4 sts=4 et sw=4 nu
+"""
+(c) 2018 Ronan Delacroix
+Job Manager Index management
+:author: Ronan Delacroix
+
+Automatic index creation on first use is disabled on all documents ('auto_create_index': False).
+Indexes declared in each document meta shall be built at deploy time, in background, with ensure_all_indexes(),
+or from the command line (job modules imported so their own indexes are built too) :
+
+    jobmanager-ensure-indexes --db mongodb://localhost/jobmanager --import mypackage.jobs [--check]
+
+check_hot_queries() runs explain() on the most frequent query shapes and flags collection scans.
+"""
+import sys
+import logging
+import argparse
+import pymongo
+
+
+def document_classes():
+    """
+    Returns every registered (non abstract) document class : library ones and the ones of imported job modules.
+    """
+    import mongoengine
+    from mongoengine.base.common import _document_registry
+    import jobmanager.common.job
+    import jobmanager.common.host
+    import jobmanager.common.docker
+    return [cls for name, cls in sorted(_document_registry.items())
+            if issubclass(cls, mongoengine.Document) and not cls._meta.get('abstract', False)]
+
+
+def ensure_all_indexes(finished_jobs_ttl=None):
+    """
+    Builds (in background) every index declared in the documents meta.
+    If finished_jobs_ttl is set (in seconds), finished jobs are also expired by mongo through a TTL index.
+    """
+    for cls in document_classes():
+        logging.info("Ensuring indexes of collection '%s'..." % cls._get_collection_name())
+        cls.ensure_indexes()
+    if finished_jobs_ttl:
+        ensure_finished_jobs_ttl(finished_jobs_ttl)
+    logging.info("Indexes OK.")
+
+
+def ensure_finished_jobs_ttl(seconds):
+    from jobmanager.common.job import Job
+    Job._get_collection().create_index(
+        [('finished', pymongo.ASCENDING)],
+        name='finished_ttl',
+        expireAfterSeconds=int(seconds),
+        partialFilterExpression={'finished': {'$exists': True}},
+        background=True
+    )
+
+
+def hot_queries(hostname='localhost'):
+    """
+    Returns the query shapes used on each job claim, worker loop and dashboard page, as (name, queryset) tuples.
+    """
+    from jobmanager.common.job import Job
+    from jobmanager.common.host import Host, HostStatus
+    host = Host.objects(hostname=hostname).first()
+    queries = [
+        ('jobs by uuid', Job.objects(uuid='')),
+        ('pending jobs', Job.objects(status='pending').order_by('+created')),
+        ('pending jobs of tenant', Job.objects(status='pending', tenant='').order_by('-priority', '+created')),
+        ('host running jobs', Job.objects(hostname=hostname, status='running')),
+        ('host by hostname', Host.objects(hostname=hostname)),
+        ('jobs page', Job.objects().order_by('-created', '-id').limit(30)),
+        ('jobs page by status', Job.objects(status='success').order_by('-created', '-id').limit(30)),
+    ]
+    if len(Job._subclasses) > 1:
+        job_class = Job._subclasses[1]
+        queries.append(('pending jobs of class', Job.objects(status='pending', _cls=job_class).order_by('-priority', '+created')))
+        queries.append(('jobs page of class', Job.objects(_cls=job_class).order_by('-created', '-id').limit(30)))
+    if host:
+        queries.append(('host history page', HostStatus.objects(host=host).order_by('-created', '-id').limit(30)))
+    return queries
+
+
+def plan_stages(plan):
+    stages = [plan.get('stage')]
+    for key in ('inputStage', 'queryPlan'):
+        if key in plan:
+            stages.extend(plan_stages(plan[key]))
+    for sub_plan in plan.get('inputStages', []):
+        stages.extend(plan_stages(sub_plan))
+    return [s for s in stages if s]
+
+
+def check_hot_queries(queries=None):
+    """
+    Runs explain() on each query and returns a list of dicts (name, stages, collscan, sort).
+    A warning is logged for each query whose winning plan is a collection scan or an in-memory (blocking) sort.
+    """
+    report = []
+    for name, queryset in (queries or hot_queries()):
+        explanation = queryset.explain()
+        stages = plan_stages(explanation.get('queryPlanner', {}).get('winningPlan', {}))
+        collscan = 'COLLSCAN' in stages
+        sort = 'SORT' in stages
+        if collscan or sort:
+            logging.warning("Query '%s' on '%s' is a %s (%s)." % (
+                name, queryset._collection.name, 'collection scan' if collscan else 'in-memory sort', ' > '.join(stages)))
+        report.append({'name': name, 'stages': stages, 'collscan': collscan, 'sort': sort})
+    return report
+
+
+def main(args=None):
+    import mongoengine
+    import jobmanager.common as common
+    parser = argparse.ArgumentParser(description='Builds the Job Manager database indexes (to run at deploy time).')
+    parser.add_argument('--db', default='mongodb://localhost/jobmanager', help='Database URI')
+    parser.add_argument('--import', dest='imports', action='append', default=[], help='Job module to import (repeatable)')
+    parser.add_argument('--finished-jobs-ttl', type=int, default=None, help='Expire finished jobs after N seconds')
+    parser.add_argument('--check', action='store_true', help='Explain hot queries and fail on collection scans or in-memory sorts')
+    args = parser.parse_args(args)
+
+    logging.basicConfig(level=logging.INFO)
+    mongoengine.connect(host=args.db)
+    common.safely_import_from_name(args.imports)
+    ensure_all_indexes(finished_jobs_ttl=args.finished_jobs_ttl)
+    if args.check and any(r['collscan'] or r['sort'] for r in check_hot_queries()):
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -41,6 +41,15 @@ class Job(common.NamedDocument, common.Runnable, common.LogProxy, common.AutoDoc
         'indexes': [
             'status',
             'created',
+            {'fields': ['status', '_cls', '-priority', 'created'], 'cls': False, 'name': 'status_cls_priority_created'},
+            {'fields': ['status', 'tenant', '-priority', 'created'], 'cls': False, 'name': 'status_tenant_priority_created',
+             'partialFilterExpression': {'tenant': {'$exists': True}}},
+            # Listing pages, see SerializableQuerySet.paginate
+            {'fields': ['created', 'id'], 'cls': False, 'name': 'created_id'},
+            {'fields': ['_cls', 'created', 'id'], 'cls': False, 'name': 'cls_created_id'},
+            {'fields': ['status', 'created', 'id'], 'cls': False, 'name': 'status_created_id'},
+            {'fields': ['hostname', 'status'], 'cls': False, 'name': 'hostname_status',
+             'partialFilterExpression': {'hostname': {'$exists': True}}},
         ]
     }
 
@@ -50,10 +59,65 @@ class Job(common.NamedDocument, common.Runnable, common.LogProxy, common.AutoDoc
     timeout = mongoengine.IntField(min_value=0, default=43200)  # 12 hours
     ttl = mongoengine.IntField(min_value=1, default=1)
     history = mongoengine.ListField(field=mongoengine.DictField(), default=[])
+    priority = mongoengine.IntField(default=0)  # Higher first, raised over time by the aging policy
+    base_priority = mongoengine.IntField()  # Priority given at submission, the aging bonus is bounded from it
+    aged = mongoengine.DateTimeField()  # Last time the aging policy raised the priority
+    tenant = mongoengine.StringField()
+    batch = mongoengine.StringField()  # Set when claimed and run in a micro-batch
+
+    checkpoint_data = mongoengine.DictField()  # {'state': <state>} of small checkpoints
+    checkpoint_blob = mongoengine.StringField()  # Blob store key of large checkpoints (extended JSON)
+    checkpointed = mongoengine.DateTimeField()
+
+    # Checkpoints bigger than this (in BSON bytes) go to the blob store, and are written at most every interval seconds.
+    checkpoint_inline_limit = 64 * 1024
+    checkpoint_interval = 60
+
+    # Each state transition is saved as one atomic update of the changed fields only, guarded on the current status.
+    # Set to False to get back to the update + full save behaviour.
+    delta_persistence = True
 
     def __str__(self):
         return "%s %s" % (self.name, job_status_to_icon.get(self.status, self.status))
 
+    def clean(self):
+        if self.base_priority is None:
+            self.base_priority = self.priority
+
+    @classmethod
+    def from_uuid(cls, uuid, archived=True):
+        """
+        Returns the job having this uuid, or None.
+        When not found in database and archived is True, falls back to the default archive if one is set.
+        """
+        job = cls.get_by_uuid(uuid)
+        if job is None:
+            # Queries only match loaded job types : import this job one through the job type registry, then retry
+            from jobmanager.common.registry import job_types, class_name
+            son = cls._get_collection().find_one({'uuid': uuid}, {'_cls': 1}) or {}
+            name = class_name(son.get('_cls', ''))
+            if name in job_types.names() and not job_types.is_loaded(name):
+                job_types.get_class(name)
+                job = cls.get_by_uuid(uuid)
+        if job is None and archived:
+            from jobmanager.common import archive
+            if archive.default_archive:
+                job = archive.default_archive.get(uuid)
+                if job is not None and not isinstance(job, cls):
+                    job = None
+        return job
+
+    @classmethod
+    def list_page(cls, token=None, limit=30, latest_first=True, reporting=True, **filters):
+        """
+        Returns a page of jobs matching the filters and the token of the next page (see SerializableQuerySet.paginate).
+        Read from the reporting connection unless reporting is False.
+        """
+        jobs = cls.objects(**filters)
+        if reporting:
+            jobs = jobs.for_reporting()
+        return jobs.paginate(limit=limit, token=token, descending=latest_first)
+
     @classmethod
     def default_slot_amount(cls):
         """
@@ -64,6 +128,24 @@ class Job(common.NamedDocument, common.Runnable, common.LogProxy, common.AutoDoc
         """
         return 1
 
+    @classmethod
+    def default_batch_size(cls):
+        """
+        Returns how many jobs of this type a worker may claim and run at once (see jobmanager.common.batch).
+        Override for high volume, sub-second jobs, whose run overhead (saves, status updates) dominates.
+        Default is 1 (no batching).
+        """
+        return 1
+
+    @classmethod
+    def placement_weight(cls):
+        """
+        Returns how heavy this job type is for load-aware placement (see jobmanager.common.placement).
+        Jobs heavier than 1 are preferably claimed by the least loaded hosts.
+        Default is 1 (claimed by any host with free slots and headroom).
+        """
+        return 1.0
+
     @cached_property
     def extra_log_arguments(self):
         return {
@@ -79,17 +161,10 @@ class Job(common.NamedDocument, common.Runnable, common.LogProxy, common.AutoDoc
         if completion:
             self.completion = completion
 
-        log = self.log_info
-        if self.status == 'error':
-            log = self.log_error
-
-        log("Progress update : {progress:5.1f}% - {message}".format(
-            progress=self.completion,
-            message=self.status_text
-        ))
+        self.log_progress()
 
         self.update(
-            add_to_set__history={'t': datetime.utcnow(), 'm': self.status_text, 'c': self.completion, 's': self.status},
+            add_to_set__history=self.history_entry(),
             status=self.status,
             details=self.details,
             completion=self.completion,
@@ -97,18 +172,159 @@ class Job(common.NamedDocument, common.Runnable, common.LogProxy, common.AutoDoc
             started=self.started,
             finished=self.finished
         )
+        self.uncache()
+
+    def log_progress(self):
+        log = self.log_info
+        if self.status == 'error':
+            log = self.log_error
+
+        log("Progress update : {progress:5.1f}% - {message}".format(
+            progress=self.completion,
+            message=self.status_text
+        ))
+
+    def history_entry(self):
+        return {'t': datetime.utcnow(), 'm': self.status_text, 'c': self.completion, 's': self.status}
 
     def update_progress(self, completion, text=None):
         self.update_status(completion=completion, text=text)
 
+    def save_transition(self, expected_status=None, history=None):
+        """
+        Persists only the changed fields (and an optional history entry) in a single atomic update.
+        The update is only applied if the status in database is still expected_status (a status or a list of them),
+        preventing lost updates. Returns True if the job was updated.
+        """
+        if not self.pk or not self.delta_persistence:
+            if history:
+                self.history.append(history)
+            self.save()
+            return True
+
+        self.updated = datetime.utcnow()
+        update = self.delta_update(history=history)
+
+        query = {'_id': self.pk}
+        if isinstance(expected_status, (list, tuple)):
+            query['status'] = {'$in': list(expected_status)}
+        elif expected_status:
+            query['status'] = expected_status
+
+        if not self._get_collection().update_one(query, update).matched_count:
+            self.log_warning("Status changed in database meanwhile, transition to '%s' not saved." % self.status)
+            return False
+        self.delta_saved(update, history=history)
+        return True
+
+    def delta_update(self, history=None):
+        """
+        Returns the update document holding only the changed fields ($set / $unset) and the history entry ($push).
+        """
+        sets, unsets = self._delta()
+        update = {}
+        if history:
+            if 'history' in sets:
+                sets['history'].append(history)
+            else:
+                update['$push'] = {'history': history}
+        if sets:
+            update['$set'] = sets
+        if unsets:
+            update['$unset'] = unsets
+        return update
+
+    def delta_saved(self, update, history=None):
+        """
+        To call once the delta_update() result is written : syncs the local history and clears the changed fields.
+        """
+        if history:  # Written by $push or within the $set history, never in the local list yet
+            self.history.append(history)
+        self._clear_changed_fields()
+        self.uncache()
+
+    def save_checkpoint(self, state, force=False):
+        """
+        Saves the processing state so a requeued job resumes from it (see Runnable.resume_state) instead of restarting.
+        State must be BSON serializable (dicts, lists, numbers, strings, datetimes...), it is never pickled.
+        Writes are throttled to one every checkpoint_interval seconds, unless forced.
+        Returns True if the checkpoint was written.
+        """
+        import bson
+        from bson import json_util
+        from jobmanager.common import checkpoint
+        now = datetime.utcnow()
+        if not force and self.checkpointed and (now - self.checkpointed).total_seconds() < self.checkpoint_interval:
+            return False
+        try:
+            size = len(bson.BSON.encode({'state': state}))
+        except (bson.InvalidDocument, TypeError) as e:
+            raise ValueError("Checkpoint state of %s is not BSON serializable : %s" % (self, e))
+        if size <= self.checkpoint_inline_limit:
+            self.checkpoint_data, self.checkpoint_blob = {'state': state}, None
+        else:
+            self.checkpoint_blob = 'job_%s' % self.uuid
+            checkpoint.blob_store.put(self.checkpoint_blob, json_util.dumps(state).encode('utf-8'))
+            self.checkpoint_data = None
+        self.checkpointed = now
+        self.update(
+            set__checkpoint_data=self.checkpoint_data,
+            set__checkpoint_blob=self.checkpoint_blob,
+            set__checkpointed=self.checkpointed
+        )
+        # Already written : keep them out of the next transition delta
+        checkpoint_fields = ('checkpoint_data', 'checkpoint_blob', 'checkpointed')
+        self._changed_fields = [f for f in self._changed_fields if f.split('.')[0] not in checkpoint_fields]
+        self.uncache()
+        return True
+
+    def load_checkpoint(self):
+        """
+        Returns the state of the last checkpoint, or None.
+        """
+        from bson import json_util
+        from jobmanager.common import checkpoint
+        if self.checkpoint_blob:
+            data = checkpoint.blob_store.get(self.checkpoint_blob)
+            return json_util.loads(data.decode('utf-8')) if data else None
+        if self.checkpoint_data:
+            return self.checkpoint_data.get('state')
+        return None
+
+    def clear_checkpoint(self):
+        from jobmanager.common import checkpoint
+        if self.checkpoint_blob:
+            checkpoint.blob_store.delete(self.checkpoint_blob)
+        self.checkpoint_data = None
+        self.checkpoint_blob = None
+        self.checkpointed = None
+
+    def save_as_running(self):
+        self.status = 'running'
+        return self.save_transition(expected_status=('new', 'pending', 'running'))
+
     def save_as_successful(self, text="Job Successful"):
-        self.update_status(100, text=text)
-        self.save()  # Saves a other fields
+        if self.checkpointed:
+            self.clear_checkpoint()
+        if not self.delta_persistence:
+            self.update_status(100, text=text)
+            self.save()  # Saves a other fields
+            return
+        self.status = 'success'
+        self.completion = 100
+        self.status_text = text
+        self.log_progress()
+        self.save_transition(expected_status='running', history=self.history_entry())
 
     def save_as_error(self, text="Job Error"):
         self.status = 'error'
-        self.update_status(text=text)
-        self.save()
+        if not self.delta_persistence:
+            self.update_status(text=text)
+            self.save()
+            return
+        self.status_text = text
+        self.log_progress()
+        self.save_transition(expected_status='running', history=self.history_entry())
 
 
 mongoengine.signals.pre_save.connect(common.update_modified)
@@ -168,6 +384,7 @@ class JobTask(mongoengine.EmbeddedDocument, common.Runnable, common.LogProxy, co
             completion=completion,
             status_text=text
         )
+        self.job.uncache()
 
     def update_progress(self, completion, text=None):
         self.update_status(completion=completion, text=text)
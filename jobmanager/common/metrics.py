@@ -0,0 +1,234 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# vim: ai ts=4 sts=4 et sw=4 nu
+"""
+(c) 2018 Ronan Delacroix
+Job Manager Metrics (Prometheus text format exporter)
+:author: Ronan Delacroix
+"""
+import time
+import logging
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from jobmanager.common import timing
+
+
+ACTIVE_STATUSES = ('new', 'pending', 'running')
+DEFAULT_BUCKETS = (0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 300, 900, 3600, 14400, 43200)
+DB_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 5)
+DB_WRITE_COMMANDS = ('insert', 'update', 'delete', 'findAndModify')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (k, str(v).replace('\\', '\\\\').replace('"', '\\"')) for k, v in labels)
+
+
+class Metric(object):
+    type = None
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        self.lock = threading.Lock()
+        self.values = {}
+
+    def _key(self, labels):
+        return tuple((name, labels.get(name, '')) for name in self.label_names)
+
+    def samples(self):
+        with self.lock:
+            return [(self.name, key, value) for key, value in self.values.items()]
+
+    def render(self):
+        lines = ["# HELP %s %s" % (self.name, self.documentation), "# TYPE %s %s" % (self.name, self.type)]
+        for name, labels, value in self.samples():
+            lines.append("%s%s %s" % (name, _format_labels(labels), repr(float(value))))
+        return '\n'.join(lines)
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    type = 'gauge'
+
+    def set(self, value, **labels):
+        with self.lock:
+            self.values[self._key(labels)] = value
+
+    def replace(self, values):
+        """
+        Replaces all the gauge values at once. Values are given as a {labels_dict_items_tuple: value} dict.
+        """
+        with self.lock:
+            self.values = {self._key(dict(labels)): value for labels, value in values.items()}
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        super(Histogram, self).__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self.lock:
+            counts, total, count = self.values.get(key, ([0] * len(self.buckets), 0.0, 0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self.values[key] = (counts, total + value, count + 1)
+
+    def samples(self):
+        samples = []
+        with self.lock:
+            for key, (counts, total, count) in self.values.items():
+                for bound, bucket_count in zip(self.buckets, counts):
+                    samples.append((self.name + '_bucket', key + (('le', repr(float(bound))),), bucket_count))
+                samples.append((self.name + '_bucket', key + (('le', '+Inf'),), count))
+                samples.append((self.name + '_sum', key, total))
+                samples.append((self.name + '_count', key, count))
+        return samples
+
+
+class Registry(object):
+
+    def __init__(self):
+        self.metrics = []
+        self.collectors = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def add_collector(self, func):
+        """
+        Adds a function called before each rendering, to refresh gauges.
+        """
+        self.collectors.append(func)
+
+    def render(self):
+        for collector in self.collectors:
+            try:
+                collector()
+            except Exception as e:
+                logging.exception("Metrics collector %s failed : %s" % (collector.__name__, e))
+        return '\n'.join(m.render() for m in self.metrics) + '\n'
+
+
+registry = Registry()
+
+jobs_finished = registry.register(Counter('jobmanager_jobs_finished_total', 'Jobs run to completion by this process.', ('job_class', 'status')))
+jobs_active = registry.register(Gauge('jobmanager_jobs', 'Jobs currently new, pending or running.', ('job_class', 'status')))
+queue_wait = registry.register(Histogram('jobmanager_job_queue_wait_seconds', 'Time between job creation and start.', ('job_class',)))
+run_time = registry.register(Histogram('jobmanager_job_run_seconds', 'Time between job start and finish.', ('job_class', 'status')))
+slot_utilization = registry.register(Gauge('jobmanager_host_slot_utilization', 'Running jobs over job slots, per host and job class.', ('hostname', 'job_class')))
+db_write_latency = registry.register(Histogram('jobmanager_db_write_seconds', 'Mongo write commands latency.', ('command',), buckets=DB_BUCKETS))
+
+
+def on_run_timed(runnable, timings=None, **kwargs):
+    from jobmanager.common.job import Job
+    if not isinstance(runnable, Job):
+        return
+    job_class = runnable.__class__.__name__
+    jobs_finished.inc(job_class=job_class, status=runnable.status)
+    if runnable.created and runnable.started:
+        queue_wait.observe((runnable.started - runnable.created).total_seconds(), job_class=job_class)
+    if runnable.started and runnable.finished:
+        run_time.observe((runnable.finished - runnable.started).total_seconds(), job_class=job_class, status=runnable.status)
+
+
+def on_db_command_timed(sender, command=None, duration=0.0, failed=False, **kwargs):
+    if command in DB_WRITE_COMMANDS:
+        db_write_latency.observe(duration, command=command)
+
+
+class ActiveJobsCollector(object):
+    """
+    Refreshes the active jobs and slot utilization gauges.
+    Only non finished jobs are grouped, through the status index, and at most once every 'interval' seconds.
+    """
+
+    def __init__(self, interval=10):
+        self.interval = interval
+        self.last_refresh = 0
+        self.__name__ = self.__class__.__name__
+
+    def __call__(self):
+        if time.time() - self.last_refresh < self.interval:
+            return
+        self.last_refresh = time.time()
+        from jobmanager.common.job import Job
+        from jobmanager.common.host import Host
+
+        pipeline = [
+            {'$match': {'status': {'$in': list(ACTIVE_STATUSES)}}},
+            {'$group': {'_id': {'cls': '$_cls', 'status': '$status', 'hostname': '$hostname'}, 'count': {'$sum': 1}}},
+        ]
+        active = {}
+        running = {}
+        for group in Job._get_collection().aggregate(pipeline):
+            job_class = group['_id'].get('cls', 'Job').split('.')[-1]
+            status = group['_id']['status']
+            key = (('job_class', job_class), ('status', status))
+            active[key] = active.get(key, 0) + group['count']
+            if status == 'running' and group['_id'].get('hostname'):
+                running[(group['_id']['hostname'], job_class)] = group['count']
+        jobs_active.replace(active)
+
+        utilization = {}
+        for host in Host.objects.only('hostname', 'job_slots'):
+            for job_class, slots in host.job_slots.items():
+                if slots:
+                    count = running.get((host.hostname, job_class), 0)
+                    utilization[(('hostname', host.hostname), ('job_class', job_class))] = count / float(slots)
+        slot_utilization.replace(utilization)
+
+
+def install(collect_interval=10):
+    """
+    Connects the metrics to the run and database hooks and registers the active jobs collector.
+    """
+    timing.run_timed.connect(on_run_timed)
+    timing.db_command_timed.connect(on_db_command_timed)
+    registry.add_collector(ActiveJobsCollector(interval=collect_interval))
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        output = registry.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(output)))
+        self.end_headers()
+        self.wfile.write(output)
+
+    def log_message(self, format, *args):
+        logging.debug("Metrics - " + format % args)
+
+
+def start_http_server(port=9108, address='', collect_interval=10):
+    """
+    Installs the metrics hooks and serves them on http://<address>:<port>/metrics in a daemon thread.
+    """
+    install(collect_interval=collect_interval)
+    server = HTTPServer((address, port), MetricsHandler)
+    thread = threading.Thread(target=server.serve_forever, name='jobmanager-metrics')
+    thread.daemon = True
+    thread.start()
+    logging.info("Metrics served on port %d." % port)
+    return server
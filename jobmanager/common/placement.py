@@ -0,0 +1,177 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# vim: ai ts=4 sts=4 et sw=4 nu
+"""
+(c) 2018 Ronan Delacroix
+Job Manager Load-aware job placement
+:author: Ronan Delacroix
+
+Combines job slots availability with the recent HostStatus telemetry of every host to decide if a host should claim
+a job of a given class. Telemetry and running jobs are read in a cached snapshot, never on each claim.
+"""
+import copy
+import time
+import threading
+from datetime import datetime, timedelta
+import jobmanager.common as common
+
+
+class HostLoad(object):
+
+    def __init__(self, hostname, cpu=0.0, memory=0.0, disk=0.0, job_slots=None, running=None, seen=None):
+        self.hostname = hostname
+        self.cpu = cpu
+        self.memory = memory
+        self.disk = disk
+        self.job_slots = job_slots or {}
+        self.running = running or {}
+        self.seen = seen
+
+    @classmethod
+    def from_system_status(cls, hostname, system_status, **kwargs):
+        system_status = system_status or {}
+        disks = [p.get('percent', 0.0) for p in system_status.get('disk', [])]
+        return cls(
+            hostname,
+            cpu=system_status.get('cpu', {}).get('percent', 0.0),
+            memory=system_status.get('memory', {}).get('virtual', {}).get('percent', 0.0),
+            disk=max(disks) if disks else 0.0,
+            **kwargs
+        )
+
+    @property
+    def load(self):
+        """
+        Host load between 0 and 1 : the most loaded resource between CPU and memory.
+        """
+        return max(self.cpu, self.memory) / 100.0
+
+    def free_slots(self, job_class):
+        return max(self.job_slots.get(job_class, 0) - self.running.get(job_class, 0), 0)
+
+    def __repr__(self):
+        return "%s (cpu %.0f%%, mem %.0f%%)" % (self.hostname, self.cpu, self.memory)
+
+
+class LoadSnapshot(object):
+    """
+    Cached view of every alive host load, refreshed at most every 'ttl' seconds with three indexed queries.
+    """
+
+    def __init__(self, ttl=15, alive_window=timedelta(minutes=0.5)):
+        self.ttl = ttl
+        self.alive_window = alive_window
+        self.hosts = {}
+        self.refreshed = 0
+        self._lock = threading.Lock()
+
+    def get(self):
+        with self._lock:
+            if time.time() - self.refreshed > self.ttl:
+                self.hosts = self.fetch()
+                self.refreshed = time.time()
+            return self.hosts
+
+    def invalidate(self):
+        self.refreshed = 0
+
+    def fetch(self):
+        from jobmanager.common.job import Job
+        from jobmanager.common.host import Host, HostStatus, unpack_system_status
+        hosts = {h.id: h for h in Host.objects.only('id', 'hostname', 'job_slots', 'status_dictionary')}
+
+        running = {}
+        pipeline = [
+            {'$match': {'status': 'running', 'hostname': {'$exists': True}}},
+            {'$group': {'_id': {'hostname': '$hostname', 'cls': '$_cls'}, 'count': {'$sum': 1}}},
+        ]
+        for group in Job._get_collection().aggregate(pipeline):
+            job_class = group['_id'].get('cls', 'Job').split('.')[-1]
+            running.setdefault(group['_id']['hostname'], {})[job_class] = group['count']
+
+        pipeline = [
+            {'$match': {'created': {'$gte': datetime.utcnow() - self.alive_window}}},
+            {'$sort': {'created': -1}},
+            {'$group': {'_id': '$host._id', 'created': {'$first': '$created'},
+                        'system_status': {'$first': '$system_status'}, 'packed': {'$first': '$packed'}}},
+        ]
+        loads = {}
+        for status in HostStatus._get_collection().aggregate(pipeline):
+            host = hosts.get(status['_id'])
+            if not host:
+                continue
+            system_status = status.get('system_status')
+            if status.get('packed'):
+                system_status = unpack_system_status(status['packed'], host.status_dictionary)
+            loads[host.hostname] = HostLoad.from_system_status(
+                host.hostname,
+                system_status,
+                job_slots=dict(host.job_slots),
+                running=running.get(host.hostname, {}),
+                seen=status['created']
+            )
+        return loads
+
+
+class PlacementEngine(common.LogProxy):
+    """
+    Decides whether a host should claim a job of a given class.
+
+    - a host never claims without a free slot, nor above max_cpu / max_memory percents (headroom),
+    - each candidate host is scored : free slot ratio * (1 - load) ^ weight, weight being Job.placement_weight(),
+    - light jobs (weight <= 1) are claimed by any host with headroom, heavy ones only if the host score is within
+      'tolerance' of the best alive host score for that class.
+    """
+
+    def __init__(self, hostname, snapshot=None, max_cpu=90.0, max_memory=90.0, tolerance=0.8):
+        self.hostname = hostname
+        self.snapshot = snapshot or LoadSnapshot()
+        self.max_cpu = max_cpu
+        self.max_memory = max_memory
+        self.tolerance = tolerance
+
+    @staticmethod
+    def score(host_load, job_class, weight=1.0):
+        slots = host_load.job_slots.get(job_class, 0)
+        if not slots:
+            return 0.0
+        free_ratio = host_load.free_slots(job_class) / float(slots)
+        return free_ratio * (max(1.0 - host_load.load, 0.0) ** weight)
+
+    def has_headroom(self, host_load):
+        return host_load.cpu < self.max_cpu and host_load.memory < self.max_memory
+
+    def should_claim(self, job_class, running=None):
+        """
+        Returns True if this host should claim a job of job_class (a Job subclass or a class name) now.
+        'running' is this host current amount of running jobs per class name, fresher than the snapshot.
+        """
+        weight = 1.0
+        if not isinstance(job_class, str):
+            weight = job_class.placement_weight()
+            job_class = job_class.__name__
+        hosts = self.snapshot.get()
+        local = hosts.get(self.hostname)
+        if local is None:
+            return True  # No telemetry yet, slots only are checked by the caller
+        if running is not None:
+            local = copy.copy(local)  # The snapshot is shared, never alter it
+            local.running = dict(running)
+            hosts = dict(hosts, **{self.hostname: local})
+        if not local.free_slots(job_class):
+            return False
+        if not self.has_headroom(local):
+            self.log_debug("No headroom to claim %s (%r)." % (job_class, local))
+            return False
+        if weight <= 1.0:
+            return True
+        scores = [self.score(h, job_class, weight) for h in hosts.values() if self.has_headroom(h)]
+        best = max(scores) if scores else 0.0
+        return self.score(local, job_class, weight) >= best * self.tolerance
+
+    def rank_hosts(self, job_class, weight=1.0):
+        """
+        Returns the alive hosts ordered by decreasing score for a job class name.
+        """
+        hosts = [h for h in self.snapshot.get().values() if self.has_headroom(h)]
+        return sorted(hosts, key=lambda h: self.score(h, job_class, weight), reverse=True)
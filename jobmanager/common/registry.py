@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# vim: ai ts=4 sts=4 et sw=4 nu
+"""
+(c) 2018 Ronan Delacroix
+Job Manager Job type registry
+:author: Ronan Delacroix
+
+Maps job class names (as stored in '_cls') to the module defining them, so job plugins are only imported on first use.
+Job types are declared through the 'jobmanager.jobs' entry point group :
+
+    entry_points={'jobmanager.jobs': ['ExecuteJob = mypackage.jobs:ExecuteJob']}
+
+or through a JSON manifest file, where default slots can be given (entry point types get DEFAULT_SLOTS until loaded) :
+
+    {"ExecuteJob": {"module": "mypackage.jobs", "slots": 2}, "WaitJob": "mypackage.jobs"}
+
+Host.localhost() populates the registry, and claims resolve job class names through it (see resolve).
+"""
+import json
+import logging
+import threading
+import importlib
+import pkg_resources
+import mongoengine.base.common
+import jobmanager.common as common
+
+
+ENTRY_POINT_GROUP = 'jobmanager.jobs'
+DEFAULT_SLOTS = 1  # Slots of job types whose module is not loaded yet and that declare none in the manifest
+
+
+def class_name(cls_name):
+    """
+    Returns the class name of a '_cls' value ('Job.ExecuteJob' -> 'ExecuteJob').
+    """
+    return cls_name.split('.')[-1]
+
+
+class JobTypeRegistry(object):
+
+    def __init__(self):
+        self.modules = {}
+        self.slots = {}
+        self.populated = False
+        self._lock = threading.RLock()
+
+    def register(self, name, module, slots=None):
+        with self._lock:
+            self.modules[class_name(name)] = module
+            if slots is not None:
+                self.slots[class_name(name)] = slots
+
+    def load_entry_points(self, group=ENTRY_POINT_GROUP):
+        for entry_point in pkg_resources.iter_entry_points(group):
+            self.register(entry_point.name, entry_point.module_name)
+
+    def load_manifest(self, path):
+        with open(path) as f:
+            manifest = json.load(f)
+        for name, definition in manifest.items():
+            if isinstance(definition, dict):
+                self.register(name, definition['module'], definition.get('slots'))
+            else:
+                self.register(name, definition)
+
+    def populate(self, manifest=None):
+        """
+        Registers the entry point job types (only once) and the ones of the manifest file, if given.
+        """
+        with self._lock:
+            if not self.populated:
+                self.load_entry_points()
+                self.populated = True
+        if manifest:
+            self.load_manifest(manifest)
+
+    def names(self):
+        return set(self.modules.keys())
+
+    def is_loaded(self, name):
+        return self._loaded_class(class_name(name)) is not None
+
+    def _loaded_class(self, name):
+        from jobmanager.common.job import Job
+        if name == Job.__name__:
+            return Job
+        for cls_name in Job._subclasses:
+            if class_name(cls_name) == name:
+                try:
+                    return mongoengine.base.common.get_document(cls_name)
+                except mongoengine.base.common.NotRegistered:
+                    return None
+        return None
+
+    def get_class(self, name):
+        """
+        Returns the job class, importing its module on first use.
+        """
+        name = class_name(name)
+        cls = self._loaded_class(name)
+        if cls is not None:
+            return cls
+        with self._lock:
+            module = self.modules.get(name)
+            if not module:
+                raise common.ConfigurationException("Unknown job type '%s' (not in job type registry)." % name)
+            logging.info("Importing module '%s' for job type '%s'." % (module, name))
+            try:
+                importlib.import_module(module)
+            except ImportError as e:
+                logging.error("Can't import Job module '%s' for job type '%s'." % (module, name))
+                raise common.ConfigurationException(e)
+        cls = self._loaded_class(name)
+        if cls is None:
+            raise common.ConfigurationException("Module '%s' does not define job type '%s'." % (module, name))
+        return cls
+
+    def resolve(self, job_class):
+        """
+        Returns job_class itself if it is a class, else the job class of this name or '_cls' value (see get_class).
+        """
+        if isinstance(job_class, str):
+            return self.get_class(job_class)
+        return job_class
+
+    def load(self, names):
+        """
+        Imports the modules of the given job types only (for instance the ones having slots on this host).
+        """
+        return [self.get_class(name) for name in names]
+
+    def default_slot_amount(self, name):
+        """
+        Returns the default slots of a job type, never importing its module :
+        slots from the manifest, else the class own default if it is already loaded, else DEFAULT_SLOTS.
+        """
+        name = class_name(name)
+        if name in self.slots:
+            return self.slots[name]
+        cls = self._loaded_class(name)
+        if cls is not None:
+            return cls.default_slot_amount()
+        return DEFAULT_SLOTS
+
+
+job_types = JobTypeRegistry()
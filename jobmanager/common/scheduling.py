@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# vim: ai ts=4 sts=4 et sw=4 nu
+"""
+(c) 2018 Ronan Delacroix
+Job Manager Priority and fair-share scheduling
+:author: Ronan Delacroix
+
+Pending jobs are claimed by decreasing priority then creation date, with one atomic indexed query
+(status, _cls or tenant, -priority, created).
+The fair-share scheduler picks which job class (or tenant) to claim from, according to weights and claims already made.
+The aging policy periodically raises, within a bounded bonus over their base priority, the priority of old pending jobs
+so low priority work eventually runs without ever outranking urgent jobs.
+"""
+import threading
+from datetime import datetime, timedelta
+import jobmanager.common as common
+
+
+CLAIM_ORDER = ('-priority', '+created')
+URGENT_PRIORITY = 100  # Priorities from this one up are only reachable at submission, never by aging
+
+
+def claim(hostname, job_class, tenant=None):
+    """
+    Atomically claims the most urgent pending job of a class (and tenant), marking it as running on hostname.
+    job_class is a Job subclass or a class name, imported on first use through the job type registry.
+    Returns the claimed job or None.
+    """
+    from jobmanager.common.registry import job_types
+    job_class = job_types.resolve(job_class)
+    filters = {'status': 'pending'}
+    if tenant is not None:
+        filters['tenant'] = tenant
+    job = job_class.objects(**filters).order_by(*CLAIM_ORDER).modify(
+        new=True,
+        set__status='running',
+        set__hostname=hostname,
+        set__started=datetime.utcnow(),
+    )
+    if job is not None:
+        job_class.uncache_ids([job.pk])
+    return job
+
+
+def age_priorities(older_than=timedelta(minutes=10), interval=timedelta(minutes=10), step=1, max_bonus=10):
+    """
+    Raises by 'step' the priority of the jobs pending for longer than 'older_than' and not aged for 'interval'.
+    Aging is relative to each job own base priority : it never goes above base_priority + max_bonus,
+    and never reaches the urgent band (URGENT_PRIORITY and above), so a big old backlog can't outrank urgent jobs.
+    Each job is rewritten at most max_bonus / step times. Meant to be called periodically.
+    Returns the amount of jobs raised.
+    """
+    from jobmanager.common.job import Job
+    now = datetime.utcnow()
+    base = {'$ifNull': ['$base_priority', {'$ifNull': ['$priority', 0]}]}
+    ceiling = {'$min': [{'$add': [base, max_bonus]}, URGENT_PRIORITY - 1]}
+    query = {
+        'status': 'pending',
+        'created': {'$lt': now - older_than},
+        '$or': [{'aged': {'$exists': False}}, {'aged': {'$lt': now - interval}}],
+        '$expr': {'$lt': [{'$ifNull': ['$priority', 0]}, ceiling]},
+    }
+    update = [{'$set': {
+        'base_priority': base,
+        'priority': {'$min': [{'$add': [{'$ifNull': ['$priority', 0]}, step]}, ceiling]},
+        'aged': now,
+    }}]
+    modified = Job._get_collection().update_many(query, update).modified_count
+    if modified:
+        Job.uncache_ids()  # Raised jobs are unknown, drop every cached one
+    return modified
+
+
+class FairShareScheduler(common.LogProxy):
+    """
+    Orders the job classes (or tenants) to claim from so that, over time, claims are shared according to weights.
+    'weights' maps class names (or tenants) to a weight, missing ones weight 'default_weight'.
+    With a placement engine (see placement.PlacementEngine), classes this host should not claim now are skipped.
+    """
+
+    def __init__(self, weights=None, default_weight=1.0, by_tenant=False, placement=None):
+        self.weights = weights or {}
+        self.default_weight = default_weight
+        self.by_tenant = by_tenant
+        self.placement = placement
+        self.claimed = {}
+        self._lock = threading.Lock()
+
+    def weight(self, key):
+        return float(self.weights.get(key, self.default_weight))
+
+    def order(self, keys):
+        """
+        Returns the keys ordered by increasing share used (claims / weight), zero weighted keys excluded.
+        """
+        with self._lock:
+            keys = [k for k in keys if self.weight(k) > 0]
+            return sorted(keys, key=lambda k: self.claimed.get(k, 0) / self.weight(k))
+
+    def record(self, key):
+        with self._lock:
+            self.claimed[key] = self.claimed.get(key, 0) + 1
+
+    def reset(self):
+        with self._lock:
+            self.claimed = {}
+
+    def claim(self, hostname, job_classes, tenants=None, running=None):
+        """
+        Claims one job, from the class (or tenant) having used the smallest share so far.
+        'job_classes' are the Job subclasses (or class names) this host has free slots for,
+        'running' this host current amount of running jobs per class name (passed to the placement engine).
+        Each attempt is a single indexed query. Returns the claimed job or None.
+        """
+        from jobmanager.common.registry import job_types
+        job_classes = [job_types.resolve(c) for c in job_classes]
+        if self.placement is not None:
+            job_classes = [c for c in job_classes if self.placement.should_claim(c, running=running)]
+        if self.by_tenant:
+            for tenant in self.order(tenants or []):
+                for job_class in job_classes:
+                    job = claim(hostname, job_class, tenant=tenant)
+                    if job:
+                        self.record(tenant)
+                        return job
+            return None
+        classes = {c.__name__: c for c in job_classes}
+        for name in self.order(classes.keys()):
+            job = claim(hostname, classes[name])
+            if job:
+                self.record(name)
+                return job
+        return None
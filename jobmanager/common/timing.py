@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# vim: ai ts=4 sts=4 et sw=4 nu
+"""
+(c) 2018 Ronan Delacroix
+Job Manager Runnable phase timings
+:author: Ronan Delacroix
+"""
+import os
+import time
+import logging
+import tempfile
+import threading
+import contextlib
+from datetime import datetime
+import blinker
+import pymongo.monitoring
+
+
+_signals = blinker.Namespace()
+
+# Sent with (runnable, phase=<name>, timing=<dict>) each time a run phase ends.
+phase_timed = _signals.signal('phase_timed')
+# Sent with (runnable, timings=<dict>) once a run is completely over (temp cleaning included).
+run_timed = _signals.signal('run_timed')
+# Sent with (None, command=<name>, duration=<seconds>, failed=<bool>) for every mongo command.
+db_command_timed = _signals.signal('db_command_timed')
+
+
+thread_time = getattr(time, 'thread_time', time.process_time)
+
+_local = threading.local()
+
+
+def db_time():
+    """
+    Returns the cumulated time (in seconds) spent waiting for mongo commands in the current thread.
+    """
+    return getattr(_local, 'db_time', 0.0)
+
+
+class DatabaseTimeListener(pymongo.monitoring.CommandListener):
+    """
+    Pymongo command listener accumulating database time per thread.
+    Must be registered before the mongo connection is created, this is done when importing this module.
+    """
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        self._record(event, failed=False)
+
+    def failed(self, event):
+        self._record(event, failed=True)
+
+    def _record(self, event, failed):
+        duration = event.duration_micros / 1000000.0
+        _local.db_time = db_time() + duration
+        if db_command_timed.receivers:
+            db_command_timed.send(None, command=event.command_name, duration=duration, failed=failed)
+
+
+pymongo.monitoring.register(DatabaseTimeListener())
+
+
+class PhaseTimer(object):
+    """
+    Measures wall, CPU and database time of each phase of a run.
+    Timings are stored in a compact form : {phase: {'w': wall, 'c': cpu, 'db': db}} in seconds.
+    """
+
+    def __init__(self, runnable):
+        self.runnable = runnable
+        self.timings = {}
+        self.started = time.time()
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        wall, cpu, db = time.time(), thread_time(), db_time()
+        try:
+            yield
+        finally:
+            timing = {
+                'w': round(time.time() - wall, 4),
+                'c': round(thread_time() - cpu, 4),
+                'db': round(db_time() - db, 4),
+            }
+            self.timings[name] = timing
+            phase_timed.send(self.runnable, phase=name, timing=timing)
+
+    @property
+    def total(self):
+        return round(time.time() - self.started, 4)
+
+    def as_dict(self):
+        timings = dict(self.timings)
+        timings['total'] = self.total
+        return timings
+
+
+class RunProfiler(object):
+    """
+    Profiles a whole run and dumps the stats file only when the run took longer than the threshold (in seconds).
+    """
+
+    def __init__(self, threshold, folder=None):
+        import cProfile
+        self.threshold = threshold
+        self.folder = folder or tempfile.gettempdir()
+        self.profile = cProfile.Profile()
+
+    def start(self):
+        self.profile.enable()
+
+    def stop(self, name, duration):
+        self.profile.disable()
+        if duration < self.threshold:
+            return None
+        os.makedirs(self.folder, exist_ok=True)
+        filename = os.path.join(self.folder, "%s_%s.prof" % (name, datetime.utcnow().strftime('%Y%m%d%H%M%S')))
+        self.profile.dump_stats(filename)
+        logging.warning("%s - Run took %.1fs (threshold %.1fs), profile dumped to %s" % (name, duration, self.threshold, filename))
+        return filename
@@ -17,6 +17,11 @@ setup(
     packages=find_packages(where='.', exclude=["fabfile", "tools", "*.tests", "*.tests.*", "tests.*", "tests"]),
     package_data={}, #{'mypkg': ['data/*.dat']},
     scripts=[],
+    entry_points={
+        'console_scripts': [
+            'jobmanager-ensure-indexes = jobmanager.common.indexes:main',
+        ],
+    },
     license=open('LICENCE.txt').read().strip(),
     description='Job Manager Common Library',
     long_description=open('README.md').read().strip(),